@@ -7,8 +7,11 @@ Created on Fri Dec  6 10:24:09 2024
 
 import pygame
 import sys
+import os
 import math
-import random
+import time as pytime
+from multiprocessing import Pool
+import numpy as np
 import matplotlib.pyplot as plt
 
 # Configuración de la ventana 
@@ -28,22 +31,167 @@ SUBSTEPS = 5
 #Tasa de enfriamiento
 COOLING_RATE =0.1
 
+# Autogravedad del disco (árbol de Barnes-Hut)
+SELF_GRAVITY = False #Activar la atracción entre partículas del disco
+THETA = 0.5 #Ángulo de apertura: mayor es más rápido pero menos preciso
+SOFTENING = 2.0 #Suavizado de la fuerza a distancias cortas
+
+# Coagulación: si se activa, cualquier par de cuerpos que choque se fusiona (no solo con el protoplaneta)
+COAGULATION = False
+
+# Integrador híbrido: las partículas lejanas derivan en su órbita de Kepler y solo las cercanas
+# al protoplaneta (dentro de HILL_FACTOR radios de Hill) se integran con RK4 en cada subpaso
+HYBRID = False
+HILL_FACTOR = 3
+
+# Integrador de cada subpaso: 'rk4' (el original), 'leapfrog' (KDK) o 'yoshida' (simpléctico de 4º orden)
+INTEGRATOR = 'rk4'
+# Pasos adaptativos por bloques: cada partícula avanza con dt/2^k, eligiendo k para que la deriva
+# relativa de energía en cada frame no supere ENERGY_TOLERANCE
+ADAPTIVE = False
+ENERGY_TOLERANCE = 1e-7
+MAX_LEVEL = 6
+MIN_LEVEL = -2 #Las órbitas tranquilas pueden avanzar con pasos de hasta dt·2^2
+
+# Modo por lotes sin ventana: BATCH_RUNS realizaciones con semillas independientes para cada combinación
+# de SWEEP, repartidas entre los núcleos, cada una durante BATCH_TIME de tiempo simulado
+BATCH = False
+BATCH_RUNS = 8
+BATCH_TIME = 100
+BATCH_SEED = 2024
+SWEEP = {'NUM_PARTICLES': (300, 1000), 'absorption_radius': (10,), 'COOLING_RATE': (0.1,)}
+BATCH_FILE = "acrecion_lotes.npz"
+
+# Registro binario de las absorciones (uno por ejecución, se puede abrir sin volver a simular)
+EVENT_LOG = "absorciones.bin"
+
+# Tiempo simulado, avanzado en cada subpaso (lo usa el registro de absorciones)
+sim_time = 0
+
+# Contador de evaluaciones de fuerza (una por cuerpo y por llamada a gravitational_acceleration)
+force_evaluations = 0
+
 # Colores que utilizaremos
 BLACK, WHITE, YELLOW, RED, BROWN = (0, 0, 0), (255, 255, 255), (255, 255, 0), (255, 50, 50), (128,64,0)
 
 
-pygame.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Formación del protoplaneta")
-clock = pygame.time.Clock()
+# Índice del protoplaneta dentro del sistema de partículas
+PROTOPLANET = 0
+
+#Sistema de partículas: posiciones, velocidades y masas en arrays contiguos
+class ParticleSystem:
+    FIELDS = ('x', 'y', 'vx', 'vy', 'mass', 'energy_lost', 'ident', 'lag')
+
+    def __init__(self, x, y, vx, vy, mass):
+        self.x = np.array(x, dtype=float)
+        self.y = np.array(y, dtype=float)
+        self.vx = np.array(vx, dtype=float)
+        self.vy = np.array(vy, dtype=float)
+        self.mass = np.array(mass, dtype=float)
+        self.energy_lost = np.zeros_like(self.mass)  # Energía acumulada perdida
+        self.ident = np.arange(len(self.mass))  # Identificador para seguir cada cuerpo tras compactar
+        self.lag = np.zeros(len(self.mass), dtype=int)  # Subpasos que lleva sin avanzar (pasos mayores que dt)
+
+    def __len__(self):
+        return len(self.mass)
+
+    #Vista de la partícula i para dibujarla o para las colisiones
+    def particle(self, i, color=WHITE):
+        return Particle(self, i, color)
+
+    #Eliminar de una vez todas las partículas marcadas (keep=False)
+    def compact(self, keep):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name)[keep])
+
+    #Copia de las partículas seleccionadas por la máscara (o por un slice)
+    def subset(self, keep):
+        part = ParticleSystem.__new__(ParticleSystem)
+        for name in self.FIELDS:
+            setattr(part, name, getattr(self, name)[keep].copy())
+        return part
+
+    #Reunir en este sistema varias partes en orden (el protoplaneta debe ir en la primera)
+    def assemble(self, *parts):
+        for name in self.FIELDS:
+            setattr(self, name, np.concatenate([getattr(part, name) for part in parts]))
+
+    #Enfriamiento de todos los cuerpos a la vez
+    def cool_down(self, dt):
+        self.energy_lost = np.maximum(self.energy_lost - COOLING_RATE * dt, 0)
+
+#Atributo de la vista que lee y escribe en el array del sistema
+class ArrayField:
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, particle, owner=None):
+        if particle is None:
+            return self
+        return getattr(particle.system, self.name)[particle.index]
+
+    def __set__(self, particle, value):
+        getattr(particle.system, self.name)[particle.index] = value
+
+#Registro de absorciones: registros de ancho fijo que se añaden al final del fichero, en bloques
+#desde un buffer de NumPy (sin listas de Python); sin fichero solo guarda el último registro
+EVENT_DTYPE = np.dtype([('time', '<f8'), ('mass', '<f8'), ('v_rel', '<f8'), ('energy_lost', '<f8'),
+                        ('protoplanet_mass', '<f8'), ('heat', '<f8'), ('body', '<i8')])
+
+class EventLog:
+    BUFFER = 4096
+
+    def __init__(self, path=None):
+        self.file = open(path, 'wb') if path else None
+        self.buffer = np.zeros(self.BUFFER, dtype=EVENT_DTYPE)
+        self.pending = 0
+        self.count = 0
+        self.protoplanet_heat = 0 #Calor del protoplaneta en su última absorción
+
+    def record(self, time, mass, v_rel, energy_lost, protoplanet_mass, heat, body):
+        row = self.buffer[self.pending]
+        row['time'], row['mass'], row['v_rel'] = time, mass, v_rel
+        row['energy_lost'], row['protoplanet_mass'] = energy_lost, protoplanet_mass
+        row['heat'], row['body'] = heat, body
+        if body == PROTOPLANET:
+            self.protoplanet_heat = heat
+        self.count += 1
+        self.pending = self.pending + 1 if self.file is not None else 0
+        if self.pending == self.BUFFER:
+            self.flush()
+
+    def flush(self):
+        if self.file is not None:
+            self.buffer[:self.pending].tofile(self.file)
+            self.file.flush()
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+
+#Abrir un registro de absorciones como array de solo lectura mapeado en memoria
+def read_event_log(path=EVENT_LOG):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.memmap(path, dtype=EVENT_DTYPE, mode='r')
+
+#Registro en uso (None: no se registra nada, como en los diagnósticos)
+event_log = None
 
 #Definimos las funciones necesarias dentro de una clase
 
+#La partícula es una vista sobre una fila del sistema
 class Particle:
-    def __init__(self, x, y, vx, vy, mass, color=WHITE):
-        self.x, self.y, self.vx, self.vy, self.mass = x, y, vx, vy, mass
+    x, y = ArrayField(), ArrayField()
+    vx, vy = ArrayField(), ArrayField()
+    mass = ArrayField()
+    energy_lost = ArrayField()
+
+    def __init__(self, system, index, color=WHITE):
+        self.system, self.index = system, index
         self.color = color
-        self.energy_lost = 0  # Energía acumulada perdida
 
     #Dibujar las partículas
     def draw(self, screen):
@@ -57,6 +205,9 @@ class Particle:
 
     #Cálculo del momento lineal y la energía cinética de la colisión inelástica
     def add_momentum(self, other):
+        v_rel = math.hypot(self.vx - other.vx, self.vy - other.vy)
+        absorbed_mass = other.mass
+
         # Conservación del momento lineal
         px = self.mass * self.vx + other.mass * other.vx
         py = self.mass * self.vy + other.mass * other.vy
@@ -84,8 +235,10 @@ class Particle:
         # Actualizar color en función de la energía perdida
         self.update_color()
         
-        # Registrar la energía acumulada para graficar
-        energy_accumulated.append(self.energy_lost)
+        # Registrar la absorción (la gráfica de calor sale de las del protoplaneta)
+        if event_log is not None:
+            event_log.record(sim_time, absorbed_mass, v_rel, energy_lost, self.system.mass[PROTOPLANET],
+                             self.energy_lost, self.system.ident[self.index])
     
     #Enfriamiento 
     def cool_down(self, dt):
@@ -105,127 +258,752 @@ class Particle:
     
         self.color = (red, green, blue)
 
-#Cálculo aceleración gravitatoria
+#Cálculo aceleración gravitatoria (acepta escalares o arrays de posiciones)
 def gravitational_acceleration(p1, p2, mass):
+    global force_evaluations
     dx, dy = p2[0] - p1[0], p2[1] - p1[1]
+    force_evaluations += np.size(dx)
     dist2 = dx**2 + dy**2 + 1e-12
+    dist = np.sqrt(dist2)
     a = G * mass / dist2
-    return a * dx / math.sqrt(dist2), a * dy / math.sqrt(dist2)
-
-#Generamos las partículas
-def initialize_particles():
-    particles = []
-    for _ in range(NUM_PARTICLES):
-        r = random.uniform(300, 400) #Radio órbita
-        ang = random.uniform(0, 2 * math.pi)
-        x, y = CENTER[0] + r * math.cos(ang), CENTER[1] + r * math.sin(ang)
-        v = math.sqrt(G * star_mass / r) 
-        vx, vy = -v * math.sin(ang), v * math.cos(ang)
-        particles.append(Particle(x, y, vx, vy, 1)) #Masa=1
-    return particles
-
-#Runge-Kutta de 4 orden
-def runge_kutta_step(particle, ax_func):
+    return a * dx / dist, a * dy / dist
+
+#Generamos las partículas (el protoplaneta ocupa la posición PROTOPLANET)
+def initialize_particles(num_particles=NUM_PARTICLES):
+    r = np.random.uniform(300, 400, num_particles) #Radio órbita
+    ang = np.random.uniform(0, 2 * math.pi, num_particles)
+    x, y = CENTER[0] + r * np.cos(ang), CENTER[1] + r * np.sin(ang)
+    v = np.sqrt(G * star_mass / r)
+    vx, vy = -v * np.sin(ang), v * np.cos(ang)
+    mass = np.ones(num_particles) #Masa=1
+
+    v_big_particle = math.sqrt(G * star_mass / 350) #Velocidad inicial del protoplaneta
+    return ParticleSystem(np.concatenate(([CENTER[0] + 350], x)),
+                          np.concatenate(([CENTER[1]], y)),
+                          np.concatenate(([0], vx)),
+                          np.concatenate(([v_big_particle], vy)),
+                          np.concatenate(([protoplanet_initial_mass], mass)))
+
+#Runge-Kutta de 4 orden (sobre una partícula o sobre todo el sistema a la vez)
+#Con t, la aceleración depende también del tiempo: ax_func(pos, t)
+def runge_kutta_step(particle, ax_func, h=dt, t=None):
     x, y, vx, vy = particle.x, particle.y, particle.vx, particle.vy
 
-    def f(state, dt):
+    def f(state, offset):
         x, y, vx, vy = state
-        ax, ay = ax_func((x, y))
+        ax, ay = ax_func((x, y)) if t is None else ax_func((x, y), t + offset)
         return vx, vy, ax, ay
 
     # RK4
     k1 = f((x, y, vx, vy), 0)
-    k2 = f((x + k1[0] * dt / 2, y + k1[1] * dt / 2, vx + k1[2] * dt / 2, vy + k1[3] * dt / 2), dt / 2)
-    k3 = f((x + k2[0] * dt / 2, y + k2[1] * dt / 2, vx + k2[2] * dt / 2, vy + k2[3] * dt / 2), dt / 2)
-    k4 = f((x + k3[0] * dt, y + k3[1] * dt, vx + k3[2] * dt, vy + k3[3] * dt), dt)
+    k2 = f((x + k1[0] * h / 2, y + k1[1] * h / 2, vx + k1[2] * h / 2, vy + k1[3] * h / 2), h / 2)
+    k3 = f((x + k2[0] * h / 2, y + k2[1] * h / 2, vx + k2[2] * h / 2, vy + k2[3] * h / 2), h / 2)
+    k4 = f((x + k3[0] * h, y + k3[1] * h, vx + k3[2] * h, vy + k3[3] * h), h)
 
-    dx = (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0]) * dt / 6
-    dy = (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1]) * dt / 6
-    dvx = (k1[2] + 2 * k2[2] + 2 * k3[2] + k4[2]) * dt / 6
-    dvy = (k1[3] + 2 * k2[3] + 2 * k3[3] + k4[3]) * dt / 6
+    dx = (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0]) * h / 6
+    dy = (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1]) * h / 6
+    dvx = (k1[2] + 2 * k2[2] + 2 * k3[2] + k4[2]) * h / 6
+    dvy = (k1[3] + 2 * k2[3] + 2 * k3[3] + k4[3]) * h / 6
 
     particle.x += dx
     particle.y += dy
     particle.vx += dvx
     particle.vy += dvy
 
-#Actualizar posiciones y velocidades
-def update_positions_and_velocities(particles, big_particle):
-    for p in particles + [big_particle]:
-        runge_kutta_step(p, lambda pos: gravitational_acceleration(pos, CENTER, star_mass))
-
-        if p is not big_particle:
-            ax_big, ay_big = gravitational_acceleration((p.x, p.y), (big_particle.x, big_particle.y), big_particle.mass)
-            p.vx += ax_big * dt
-            p.vy += ay_big * dt
-
-#Acreción de partículas por el protoplaneta si se encuentran dentro del radio de absorción
-def absorb_particles(particles, big_particle):
-    for p in particles[:]:
-        if big_particle.distance_to(p) < absorption_radius + math.sqrt(p.mass):
-            big_particle.add_momentum(p)
-            particles.remove(p)
+#Leapfrog impulso-deriva-impulso; devuelve la aceleración final para reutilizarla en el paso siguiente
+def leapfrog_step(particle, ax_func, h, t, acc=None):
+    ax, ay = acc if acc is not None else ax_func((particle.x, particle.y), t)
+    particle.vx += ax * h / 2
+    particle.vy += ay * h / 2
+    particle.x += particle.vx * h
+    particle.y += particle.vy * h
+    ax, ay = ax_func((particle.x, particle.y), t + h)
+    particle.vx += ax * h / 2
+    particle.vy += ay * h / 2
+    return ax, ay
+
+#Coeficientes del integrador de Yoshida de 4º orden
+YOSHIDA_W1 = 1 / (2 - 2**(1/3))
+YOSHIDA_W0 = -2**(1/3) * YOSHIDA_W1
+YOSHIDA_DRIFT = (YOSHIDA_W1 / 2, (YOSHIDA_W0 + YOSHIDA_W1) / 2, (YOSHIDA_W0 + YOSHIDA_W1) / 2, YOSHIDA_W1 / 2)
+YOSHIDA_KICK = (YOSHIDA_W1, YOSHIDA_W0, YOSHIDA_W1)
+
+#Yoshida de 4º orden (deriva-impulso alternados, tres evaluaciones de fuerza por paso)
+def yoshida_step(particle, ax_func, h, t, acc=None):
+    for i, kick_weight in enumerate(YOSHIDA_KICK):
+        particle.x += particle.vx * YOSHIDA_DRIFT[i] * h
+        particle.y += particle.vy * YOSHIDA_DRIFT[i] * h
+        t += YOSHIDA_DRIFT[i] * h
+        ax, ay = ax_func((particle.x, particle.y), t)
+        particle.vx += ax * kick_weight * h
+        particle.vy += ay * kick_weight * h
+    particle.x += particle.vx * YOSHIDA_DRIFT[3] * h
+    particle.y += particle.vy * YOSHIDA_DRIFT[3] * h
+
+def rk4_step(particle, ax_func, h, t, acc=None):
+    runge_kutta_step(particle, ax_func, h, t)
+
+#Familia de integradores y su orden (para elegir el paso según la tolerancia)
+INTEGRATORS = {'rk4': (rk4_step, 4), 'leapfrog': (leapfrog_step, 2), 'yoshida': (yoshida_step, 4)}
+
+#Entrelazar los bits de x e y (orden de Morton) para ordenar las celdas del árbol
+def morton_key(ix, iy):
+    def spread(v):
+        v = v & 0xFFFF
+        v = (v | (v << 8)) & 0x00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F
+        v = (v | (v << 2)) & 0x33333333
+        v = (v | (v << 1)) & 0x55555555
+        return v
+    return (spread(ix) << 1) | spread(iy)
+
+#Árbol cuaternario de Barnes-Hut construido nivel a nivel sobre arrays
+class QuadTree:
+    CHUNK = 4096 #Partículas que recorren el árbol a la vez
+
+    def __init__(self, x, y, mass):
+        n = len(mass)
+        self.depth = int(np.clip(np.ceil(np.log(max(n, 2)) / np.log(4)) + 1, 1, 16))
+        x0, y0 = x.min(), y.min()
+        size = max(x.max() - x0, y.max() - y0, 1e-9) * (1 + 1e-9)
+        cells = 1 << self.depth
+        ix = np.minimum(((x - x0) / size * cells).astype(np.int64), cells - 1)
+        iy = np.minimum(((y - y0) / size * cells).astype(np.int64), cells - 1)
+        keys = morton_key(ix, iy)
+
+        # Las partículas se ordenan por celda, de modo que cada nodo es un bloque contiguo
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        self.x, self.y, self.mass = x[self.order], y[self.order], mass[self.order]
+
+        # Por nivel: clave, masa y centro de masas de cada nodo ocupado
+        self.levels = []
+        for level in range(self.depth + 1):
+            level_keys = self.keys >> (2 * (self.depth - level))
+            starts = np.flatnonzero(np.r_[True, level_keys[1:] != level_keys[:-1]])
+            m = np.add.reduceat(self.mass, starts)
+            self.levels.append({
+                'keys': level_keys[starts],
+                'mass': m,
+                'comx': np.add.reduceat(self.mass * self.x, starts) / m,
+                'comy': np.add.reduceat(self.mass * self.y, starts) / m,
+                'size': size / (1 << level),
+                'start': starts,
+                'end': np.r_[starts[1:], n],
+            })
+        # Hijos de cada nodo dentro del nivel siguiente
+        for parent, child in zip(self.levels[:-1], self.levels[1:]):
+            parent['child_start'] = np.searchsorted(child['keys'], parent['keys'] * 4)
+            parent['child_end'] = np.searchsorted(child['keys'], parent['keys'] * 4 + 4)
+
+    #Aceleración sobre cada partícula debida al resto (en el orden original)
+    def acceleration(self, theta):
+        n = len(self.mass)
+        ax, ay = np.zeros(n), np.zeros(n)
+        for first in range(0, n, self.CHUNK):
+            last = min(first + self.CHUNK, n)
+            p = np.arange(first, last)
+            node = np.zeros(len(p), dtype=np.int64)
+            for level, nodes in enumerate(self.levels):
+                if level == self.depth:
+                    # En las hojas se suma partícula a partícula
+                    p, j = expand(p, nodes['start'][node], nodes['end'][node])
+                    other = j != p
+                    p, j = p[other], j[other]
+                    self.accumulate(ax, ay, first, last, p, self.x[j] - self.x[p],
+                                    self.y[j] - self.y[p], self.mass[j])
+                    break
+                dx = nodes['comx'][node] - self.x[p]
+                dy = nodes['comy'][node] - self.y[p]
+                # Un nodo lejano (tamaño/distancia < theta) que no contiene a la partícula actúa como una sola masa
+                own = (self.keys[p] >> (2 * (self.depth - level))) == nodes['keys'][node]
+                far = ~own & (nodes['size']**2 < theta**2 * (dx**2 + dy**2))
+                self.accumulate(ax, ay, first, last, p[far], dx[far], dy[far], nodes['mass'][node[far]])
+                p, node = expand(p[~far], nodes['child_start'][node[~far]], nodes['child_end'][node[~far]])
+
+        out_x, out_y = np.empty(n), np.empty(n)
+        out_x[self.order], out_y[self.order] = ax, ay
+        return out_x, out_y
+
+    def accumulate(self, ax, ay, first, last, p, dx, dy, mass):
+        a = G * mass / (dx**2 + dy**2 + SOFTENING**2)**1.5
+        ax[first:last] += np.bincount(p - first, a * dx, last - first)
+        ay[first:last] += np.bincount(p - first, a * dy, last - first)
+
+#Repetir cada índice de p tantas veces como elementos hay en [start, end)
+def expand(p, start, end):
+    counts = end - start
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(p, counts), np.repeat(start, counts) + offsets
+
+#Autogravedad del disco con Barnes-Hut (el árbol se reconstruye en cada llamada)
+def barnes_hut_acceleration(x, y, mass, theta=THETA):
+    if len(mass) < 2:
+        return np.zeros(len(mass)), np.zeros(len(mass))
+    return QuadTree(x, y, mass).acceleration(theta)
+
+#Suma directa O(N·M) sobre las partículas 'targets', como referencia
+def direct_acceleration(x, y, mass, targets):
+    dx = x[None, :] - x[targets, None]
+    dy = y[None, :] - y[targets, None]
+    a = G * mass[None, :] / (dx**2 + dy**2 + SOFTENING**2)**1.5
+    return (a * dx).sum(axis=1), (a * dy).sum(axis=1)
+
+#Error relativo medio de la fuerza y coste frente a theta, para elegir un compromiso velocidad/precisión
+def barnes_hut_error(system, thetas=(0.2, 0.3, 0.5, 0.7, 1.0), sample=200):
+    disk = np.arange(len(system)) != PROTOPLANET
+    x, y, mass = system.x[disk], system.y[disk], system.mass[disk]
+    targets = np.random.choice(len(mass), min(sample, len(mass)), replace=False)
+    ax_ref, ay_ref = direct_acceleration(x, y, mass, targets)
+    norm = np.hypot(ax_ref, ay_ref) + 1e-300
+    results = []
+    for theta in thetas:
+        start = pytime.perf_counter()
+        ax, ay = barnes_hut_acceleration(x, y, mass, theta)
+        elapsed = pytime.perf_counter() - start
+        error = np.sqrt(np.mean((np.hypot(ax[targets] - ax_ref, ay[targets] - ay_ref) / norm)**2))
+        results.append((theta, error, elapsed))
+    return results
+
+#Actualizar posiciones y velocidades de todo el sistema en una sola evaluación
+def update_positions_and_velocities(system, h=dt):
+    # El protoplaneta atrae al disco desde su posición al inicio del paso
+    big_x, big_y, big_mass = system.x[PROTOPLANET], system.y[PROTOPLANET], system.mass[PROTOPLANET]
+
+    runge_kutta_step(system, lambda pos: gravitational_acceleration(pos, CENTER, star_mass), h)
+
+    ax_big, ay_big = gravitational_acceleration((system.x, system.y), (big_x, big_y), big_mass)
+    ax_big[PROTOPLANET] = ay_big[PROTOPLANET] = 0
+    system.vx += ax_big * h
+    system.vy += ay_big * h
+
+#Atracción entre las partículas del disco, como un impulso de duración dt
+def self_gravity_kick(system):
+    disk = np.arange(len(system)) != PROTOPLANET
+    ax_self, ay_self = barnes_hut_acceleration(system.x[disk], system.y[disk], system.mass[disk])
+    system.vx[disk] += ax_self * dt
+    system.vy[disk] += ay_self * dt
+
+#Funciones de Stumpff C(z) y S(z) (con su serie de Taylor cerca de z=0)
+def stumpff(z):
+    small = np.abs(z) < 1e-2
+    zs = np.where(small, 1.0, z)
+    sq = np.sqrt(np.abs(zs))
+    c = np.where(zs > 0, (1 - np.cos(sq)) / zs, (np.cosh(sq) - 1) / -zs)
+    s_ = np.where(zs > 0, (sq - np.sin(sq)) / sq**3, (np.sinh(sq) - sq) / sq**3)
+    c = np.where(small, 1/2 - z/24 + z**2/720 - z**3/40320, c)
+    s_ = np.where(small, 1/6 - z/120 + z**2/5040 - z**3/362880, s_)
+    return c, s_
+
+#Deriva exacta en la órbita de Kepler alrededor de la estrella (variables universales)
+def kepler_drift(bodies, t):
+    mu = G * star_mass
+    sqrt_mu = math.sqrt(mu)
+    x, y = bodies.x - CENTER[0], bodies.y - CENTER[1]
+    vx, vy = bodies.vx, bodies.vy
+    r0 = np.hypot(x, y)
+    vr0 = (x * vx + y * vy) / r0
+    alpha = 2 / r0 - (vx**2 + vy**2) / mu
+
+    # Newton sobre la anomalía universal chi
+    chi = sqrt_mu * np.abs(alpha) * t
+    for _ in range(50):
+        c, s_ = stumpff(alpha * chi**2)
+        F = (r0 * vr0 / sqrt_mu * chi**2 * c + (1 - alpha * r0) * chi**3 * s_
+             + r0 * chi - sqrt_mu * t)
+        dF = (r0 * vr0 / sqrt_mu * chi * (1 - alpha * chi**2 * s_)
+              + (1 - alpha * r0) * chi**2 * c + r0)
+        step = F / dF
+        chi = chi - step
+        if np.all(np.abs(step) < 1e-12 * (1 + np.abs(chi))):
+            break
+
+    c, s_ = stumpff(alpha * chi**2)
+    f = 1 - chi**2 / r0 * c
+    g = t - chi**3 / sqrt_mu * s_
+    new_x, new_y = f * x + g * vx, f * y + g * vy
+    r = np.hypot(new_x, new_y)
+    fdot = sqrt_mu / (r * r0) * (alpha * chi**3 * s_ - chi)
+    gdot = 1 - chi**2 / r * c
+    bodies.vx, bodies.vy = fdot * x + gdot * vx, fdot * y + gdot * vy
+    bodies.x, bodies.y = CENTER[0] + new_x, CENTER[1] + new_y
+
+#Radio de Hill del protoplaneta respecto a la estrella
+def hill_radius(system):
+    a = math.hypot(system.x[PROTOPLANET] - CENTER[0], system.y[PROTOPLANET] - CENTER[1])
+    return a * (system.mass[PROTOPLANET] / (3 * star_mass))**(1/3)
+
+#Impulso de duración t sobre las partículas lejanas (protoplaneta y, si está activa, autogravedad)
+def kick(far, big_x, big_y, big_mass, t, self_ax=0, self_ay=0):
+    ax, ay = gravitational_acceleration((far.x, far.y), (big_x, big_y), big_mass)
+    far.vx += (ax + self_ax) * t
+    far.vy += (ay + self_ay) * t
+
+#Paso híbrido de un frame completo (dt·SUBSTEPS), al estilo de MERCURY:
+#las partículas lejanas hacen impulso-deriva de Kepler-impulso y las cercanas el integrador elegido por subpasos.
+#Devuelve el error de energía estimado del frame
+def hybrid_step(system, collide=None):
+    collide = collide or absorb_particles
+    frame_dt = dt * SUBSTEPS
+    big_x, big_y = system.x[PROTOPLANET], system.y[PROTOPLANET]
+    big_vx, big_vy = system.vx[PROTOPLANET], system.vy[PROTOPLANET]
+
+    # Cercanas: dentro de HILL_FACTOR radios de Hill, más lo que puedan acercarse durante el frame
+    dist = np.hypot(system.x - big_x, system.y - big_y)
+    v_rel = np.hypot(system.vx - big_vx, system.vy - big_vy)
+    near = dist < HILL_FACTOR * hill_radius(system) + v_rel * frame_dt
+    near[PROTOPLANET] = True
+
+    self_ax = self_ay = 0
+    if SELF_GRAVITY and len(system) > 1:
+        disk = np.arange(len(system)) != PROTOPLANET
+        ax_disk, ay_disk = np.zeros(len(system)), np.zeros(len(system))
+        ax_disk[disk], ay_disk[disk] = barnes_hut_acceleration(system.x[disk], system.y[disk], system.mass[disk])
+        self_ax, self_ay = ax_disk[~near], ay_disk[~near]
+
+    close, far = system.subset(near), system.subset(~near)
+    big = system.subset([PROTOPLANET])
+    sample, weights = error_sample(far, big)
+    refined = far.subset(sample)
+    kick(far, big_x, big_y, big.mass[0], frame_dt / 2, self_ax, self_ay)
+    kepler_drift(far, frame_dt)
+
+    error = 0
+    for _ in range(SUBSTEPS):
+        error += integrate_substep(close)
+        collide(close)
+
+    kick(far, close.x[PROTOPLANET], close.y[PROTOPLANET], close.mass[PROTOPLANET], frame_dt / 2, self_ax, self_ay)
+
+    # Error de la parte lejana: la muestra repite el frame con dos pasos de medio frame
+    big_path = big.subset(slice(None))
+    sample_ax = self_ax[sample] if SELF_GRAVITY else 0
+    sample_ay = self_ay[sample] if SELF_GRAVITY else 0
+    for _ in range(2):
+        kick(refined, big_path.x[0], big_path.y[0], big.mass[0], frame_dt / 4, sample_ax, sample_ay)
+        kepler_drift(refined, frame_dt / 2)
+        kepler_drift(big_path, frame_dt / 2)
+        kick(refined, big_path.x[0], big_path.y[0], big.mass[0], frame_dt / 4, sample_ax, sample_ay)
+    error += energy_error(far.subset(sample), refined, weights, close.subset([PROTOPLANET]))
+    system.assemble(close, far)
+    collide(system)
+    return error
+
+#Tiempo dinámico de cada cuerpo frente a la estrella y al protoplaneta (big)
+def dynamical_time(bodies, big):
+    r_star = np.hypot(bodies.x - CENTER[0], bodies.y - CENTER[1])
+    r_big = np.maximum(np.hypot(bodies.x - big.x[0], bodies.y - big.y[0]), 1e-9)
+    return np.minimum(np.sqrt(r_star**3 / (G * star_mass)), np.sqrt(r_big**3 / (G * big.mass[0])))
+
+#Factor de los pasos adaptativos, corregido cada frame con el error de energía estimado
+step_scale = 1.0
+
+#Nivel de paso de cada cuerpo: dt/2^k por debajo de su tiempo dinámico escalado por la tolerancia
+#(k negativo: varios subpasos por paso; no en el modo híbrido, que mueve lo lejano por frames)
+def step_levels(bodies, big):
+    h = step_scale * dynamical_time(bodies, big) * ENERGY_TOLERANCE**(1 / INTEGRATORS[INTEGRATOR][1])
+    return np.clip(np.ceil(np.log2(dt / h)), 0 if HYBRID else MIN_LEVEL, MAX_LEVEL).astype(int)
+
+#Aceleración de la estrella y del protoplaneta; este solo siente la estrella y sigue su órbita de Kepler
+#desde el estado big, así que se puede evaluar exactamente en cualquier instante t del subpaso
+def field_acceleration(big):
+    big_positions = {}
+
+    def big_at(t):
+        if t not in big_positions:
+            moved = big.subset(slice(None))
+            if t != 0:
+                kepler_drift(moved, t)
+            big_positions[t] = (moved.x[0], moved.y[0])
+        return big_positions[t]
+
+    def acceleration(pos, t):
+        ax, ay = gravitational_acceleration(pos, CENTER, star_mass)
+        ax_big, ay_big = gravitational_acceleration(pos, big_at(t), big.mass[0])
+        return ax + ax_big, ay + ay_big
+    return acceleration
+
+#Avanzar cada cuerpo 'pending' subpasos (los que lleva de retraso más el actual) con 'steps' pasos,
+#agrupando los cuerpos que comparten ambos valores
+def block_integrate(bodies, pending, steps, step, acceleration):
+    keys = steps * (2**-MIN_LEVEL + 1) + pending
+    for key in np.unique(keys):
+        members = keys == key
+        group = bodies.subset(members)
+        n = steps[members][0]
+        span = dt * pending[members][0]
+        h, t0, acc = span / n, dt - span, None
+        for i in range(n):
+            acc = step(group, acceleration, h, t0 + i * h, acc)
+        for name in ('x', 'y', 'vx', 'vy'):
+            getattr(bodies, name)[members] = getattr(group, name)
+
+#Energía de cada cuerpo en el campo de la estrella y del protoplaneta big
+def body_energy(bodies, big):
+    r_star = np.hypot(bodies.x - CENTER[0], bodies.y - CENTER[1])
+    r_big = np.maximum(np.hypot(bodies.x - big.x[0], bodies.y - big.y[0]), 1e-9)
+    m = bodies.mass
+    return 0.5 * m * (bodies.vx**2 + bodies.vy**2) - G * star_mass * m / r_star - G * big.mass[0] * m / r_big
+
+#Cuerpos usados para estimar el error: los ERROR_SAMPLE más exigentes y otros tantos al azar
+#(por rechazo, sin recorrer el resto), estos con peso para representar al resto. skip: índices excluidos
+ERROR_SAMPLE = 32
+
+def error_sample(bodies, big, skip=()):
+    n = len(bodies)
+    if n - len(skip) <= 2 * ERROR_SAMPLE:
+        index = np.setdiff1d(np.arange(n), skip)
+        return index, np.ones(len(index))
+    # Mismo orden que el tiempo dinámico (su cuarta potencia), sin raíces
+    r2_star = (bodies.x - CENTER[0])**2 + (bodies.y - CENTER[1])**2
+    r2_big = (bodies.x - big.x[0])**2 + (bodies.y - big.y[0])**2
+    urgency = np.minimum(r2_star**3 / star_mass**2, r2_big**3 / big.mass[0]**2)
+    urgency[list(skip)] = np.inf
+    critical = np.argpartition(urgency, ERROR_SAMPLE)[:ERROR_SAMPLE]
+    taken = set(critical.tolist()) | set(skip)
+    chosen = []
+    while len(chosen) < ERROR_SAMPLE:
+        i = np.random.randint(n)
+        if i not in taken:
+            taken.add(i)
+            chosen.append(i)
+    rest = n - len(skip) - ERROR_SAMPLE
+    weights = np.r_[np.ones(ERROR_SAMPLE), np.full(ERROR_SAMPLE, rest / ERROR_SAMPLE)]
+    return np.r_[critical, chosen], weights
+
+#Error de energía de un paso por duplicación: la muestra se repite con la mitad de paso y se comparan
+#las energías finales (el cambio físico es el mismo en las dos, así que la diferencia es error del integrador)
+def energy_error(after, refined, weights, big_end):
+    return np.sum(weights * np.abs(body_energy(after, big_end) - body_energy(refined, big_end)))
+
+#Subpaso del esquema original; el error se estima repitiendo la muestra (junto al protoplaneta)
+#con dos medios pasos del mismo esquema, así que mide solo el error de este
+def original_substep(system):
+    big = system.subset([PROTOPLANET])
+    sample, weights = error_sample(system, big, skip=(PROTOPLANET,))
+    refined = system.subset(np.r_[PROTOPLANET, sample])
+    update_positions_and_velocities(system)
+    for _ in range(2):
+        update_positions_and_velocities(refined, dt / 2)
+    refined = refined.subset(slice(1, None))
+    return energy_error(system.subset(sample), refined, weights, system.subset([PROTOPLANET]))
+
+#Subpaso con el integrador elegido: el RK4 original o la familia seleccionable con pasos por bloques.
+#Los cuerpos con pasos mayores que dt esperan hasta completar su paso (o hasta synchronize).
+#Devuelve el error de energía estimado (sin contar las colisiones ni la autogravedad)
+def integrate_substep(system, synchronize=False):
+    global sim_time
+    sim_time += dt
+    if INTEGRATOR == 'rk4' and not ADAPTIVE:
+        error = original_substep(system)
+    else:
+        error = block_substep(system, synchronize)
+    if SELF_GRAVITY:
+        self_gravity_kick(system)
+    return error
+
+#Subpaso de la familia seleccionable con pasos por bloques, estimando el error por duplicación
+def block_substep(system, synchronize):
+    disk = np.arange(len(system)) != PROTOPLANET
+    big = system.subset([PROTOPLANET])
+    bodies = system.subset(disk)
+    acceleration = field_acceleration(big)
+    step = INTEGRATORS[INTEGRATOR][0]
+
+    levels = step_levels(bodies, big) if ADAPTIVE else np.zeros(len(bodies), dtype=int)
+    pending = bodies.lag + 1
+    due = (pending * 2.0**levels >= 1) | synchronize
+    steps = np.maximum(np.ceil(pending * 2.0**levels - 1e-9), 1).astype(int)
+    due_index = np.flatnonzero(due)
+    sample, weights = error_sample(bodies.subset(due_index), big)
+    sample = due_index[sample]
+    refined = bodies.subset(sample)
+
+    moving = bodies.subset(due_index)
+    block_integrate(moving, pending[due], steps[due], step, acceleration)
+    for name in ('x', 'y', 'vx', 'vy'):
+        getattr(bodies, name)[due_index] = getattr(moving, name)
+        getattr(system, name)[disk] = getattr(bodies, name)
+    system.lag[disk] = np.where(due, 0, pending)
+    big_end = big.subset(slice(None))
+    kepler_drift(big_end, dt)
+    for name in ('x', 'y', 'vx', 'vy'):
+        getattr(system, name)[PROTOPLANET] = getattr(big_end, name)[0]
+
+    block_integrate(refined, pending[sample], 2 * steps[sample], step, acceleration)
+    return energy_error(bodies.subset(sample), refined, weights, big_end)
+
+#Avanzar un frame con el integrador elegido; devuelve el error relativo de energía estimado del frame
+def advance_frame(system):
+    global step_scale
+    energy = body_energy(system, system.subset([PROTOPLANET]))
+    energy[PROTOPLANET] = 0
+    total = abs(energy.sum())
+    if HYBRID:
+        error = hybrid_step(system)
+    else:
+        error = 0
+        for _ in range(SUBSTEPS):
+            error += integrate_substep(system)
+            absorb_particles(system)
+    drift = error / total if total > 0 else 0.0
+
+    # Ajuste de los pasos por bloques para mantener el error dentro del presupuesto
+    if ADAPTIVE:
+        if drift > ENERGY_TOLERANCE:
+            step_scale = max(step_scale / 2, 2.0**-MAX_LEVEL)
+        elif drift < ENERGY_TOLERANCE / 4:
+            step_scale = min(step_scale * 2, 1e6)
+    return drift
+
+#Energía de Jacobi de cada cuerpo del disco: se conserva porque el protoplaneta describe una órbita circular
+def jacobi_energy(system):
+    x, y = system.x - CENTER[0], system.y - CENTER[1]
+    vx, vy, m = system.vx, system.vy, system.mass
+    big_x, big_y = x[PROTOPLANET], y[PROTOPLANET]
+    omega = (big_x * vy[PROTOPLANET] - big_y * vx[PROTOPLANET]) / (big_x**2 + big_y**2)
+    kinetic = 0.5 * m * (vx**2 + vy**2)
+    dist_big = np.hypot(x - big_x, y - big_y)
+    dist_big[PROTOPLANET] = 1
+    potential = -G * star_mass * m / np.hypot(x, y) - G * m[PROTOPLANET] * m / dist_big
+    energy = kinetic + potential - omega * m * (x * vy - y * vx)
+    energy[PROTOPLANET] = 0
+    return energy
+
+#Retirar sin fusionar las partículas capturadas, para que el protoplaneta no cambie en el diagnóstico
+def remove_captured(system):
+    dist = np.hypot(system.x - system.x[PROTOPLANET], system.y - system.y[PROTOPLANET])
+    captured = dist < absorption_radius + np.sqrt(system.mass)
+    captured[PROTOPLANET] = False
+    system.compact(~captured)
+
+#Diagnóstico: deriva de la energía de las partículas no capturadas y evaluaciones de fuerza,
+#integrador por subpasos frente al híbrido
+def compare_integrators(frames=200, num_particles=2000):
+    global force_evaluations
+    np.random.seed(1)
+    reference = initialize_particles(num_particles)
+    initial_energy = jacobi_energy(reference)
+    results = []
+    for name in (INTEGRATOR, 'Híbrido'):
+        system = reference.subset(slice(None))
+        force_evaluations = 0
+        for frame in range(frames):
+            if name != 'Híbrido':
+                for substep in range(SUBSTEPS):
+                    # En el último subpaso se ponen al día los cuerpos con pasos largos
+                    integrate_substep(system, synchronize=(frame, substep) == (frames - 1, SUBSTEPS - 1))
+                    remove_captured(system)
+            else:
+                hybrid_step(system, remove_captured)
+        e0 = initial_energy[system.ident].sum()
+        results.append((name, abs(jacobi_energy(system).sum() / e0 - 1), force_evaluations))
+    return results
+
+#Radio de colisión de cada cuerpo: el protoplaneta captura dentro de absorption_radius
+def collision_radius(system):
+    radius = np.sqrt(system.mass)
+    radius[PROTOPLANET] = absorption_radius
+    return radius
+
+#Pares candidatos (i, j) que se tocan, buscados con una rejilla de celdas por cada escala de radio
+def find_collision_pairs(x, y, radius):
+    # Cada cuerpo va a la rejilla cuya celda (base·2^k) cubre su diámetro
+    base = 2 * radius.min()
+    level = np.maximum(np.ceil(np.log2(2 * radius / base)), 0).astype(np.int64)
+    x0, y0 = x.min(), y.min()
+    stride = np.int64(1) << 31
+    pairs_i, pairs_j = [], []
+    for k in np.unique(level):
+        h = base * 2.0**k
+        cx = ((x - x0) // h).astype(np.int64) + 1
+        cy = ((y - y0) // h).astype(np.int64) + 1
+        members = np.flatnonzero(level == k)
+        cell = cx[members] * stride + cy[members]
+        order = np.argsort(cell, kind='stable')
+        members, cell = members[order], cell[order]
+        # Cuerpos de este nivel o menores buscan en las 3x3 celdas vecinas
+        queries = np.flatnonzero(level <= k)
+        for ox in (-1, 0, 1):
+            for oy in (-1, 0, 1):
+                target = (cx[queries] + ox) * stride + cy[queries] + oy
+                start = np.searchsorted(cell, target, 'left')
+                end = np.searchsorted(cell, target, 'right')
+                i, pos = expand(queries, start, end)
+                j = members[pos]
+                keep = (level[i] < k) | (i < j)
+                pairs_i.append(i[keep])
+                pairs_j.append(j[keep])
+    i, j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+    touching = np.hypot(x[i] - x[j], y[i] - y[j]) < radius[i] + radius[j]
+    return i[touching], j[touching]
+
+#Acreción: los cuerpos que chocan se fusionan con add_momentum y se eliminan en una sola pasada
+def absorb_particles(system):
+    radius = collision_radius(system)
+    if COAGULATION:
+        i, j = find_collision_pairs(system.x, system.y, radius)
+    else:
+        # Solo absorbe el protoplaneta: basta con comparar todas las partículas con él
+        dist = np.hypot(system.x - system.x[PROTOPLANET], system.y - system.y[PROTOPLANET])
+        j = np.flatnonzero(dist < radius + radius[PROTOPLANET])
+        j = j[j != PROTOPLANET]
+        i = np.full(len(j), PROTOPLANET)
+    if len(i) == 0:
+        return
+
+    # Sobrevive el protoplaneta o, si no participa, el cuerpo más masivo
+    mi, mj = system.mass[i], system.mass[j]
+    swap = (j == PROTOPLANET) | ((i != PROTOPLANET) & ((mj > mi) | ((mj == mi) & (j < i))))
+    survivor, absorbed = np.where(swap, j, i), np.where(swap, i, j)
+    order = np.lexsort((absorbed, survivor))
+
+    alive = np.ones(len(system), dtype=bool)
+    for s, a in zip(survivor[order], absorbed[order]):
+        if alive[s] and alive[a]:
+            system.particle(s).add_momentum(system.particle(a))
+            alive[a] = False
+    system.compact(alive)
+
+#Dibujar el polvo del disco de una vez sobre los píxeles de la pantalla
+def draw_dust(screen, system):
+    small = np.sqrt(system.mass) < 3  # Las partículas de radio 2 se estampan como píxeles
+    small[PROTOPLANET] = False
+    x, y = system.x[small].astype(int), system.y[small].astype(int)
+    pixels = pygame.surfarray.pixels3d(screen)
+    for ox, oy in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+        px, py = x + ox, y + oy
+        visible = (px >= 0) & (px < WIDTH) & (py >= 0) & (py < HEIGHT)
+        pixels[px[visible], py[visible]] = WHITE
+    del pixels
+    # Los embriones se dibujan como círculos con el color de su calor acumulado
+    for i in np.flatnonzero(~small):
+        if i != PROTOPLANET:
+            embryo = system.particle(i)
+            embryo.update_color()
+            embryo.draw(screen)
+
+#Una realización sin ventana; devuelve la curva de calor (un valor por frame, como en la gráfica)
+#y la masa final del protoplaneta
+def run_realization(task):
+    global absorption_radius, COOLING_RATE, event_log, step_scale, sim_time
+    num_particles, absorption_radius, COOLING_RATE, seed = task
+    np.random.seed(seed)
+    event_log, step_scale, sim_time = EventLog(), 1.0, 0
+    system = initialize_particles(num_particles)
+    frames = int(round(BATCH_TIME / (dt * SUBSTEPS)))
+    heat = np.zeros(frames, dtype=np.float32)
+    for frame in range(frames):
+        advance_frame(system)
+        system.cool_down(dt * SUBSTEPS)
+        heat[frame] = event_log.protoplanet_heat
+    return heat, system.mass[PROTOPLANET]
+
+#Barrido por lotes: todas las realizaciones en un Pool de procesos y un único fichero comprimido
+def run_batch():
+    tasks = [(n, radius, cooling)
+             for n in SWEEP['NUM_PARTICLES']
+             for radius in SWEEP['absorption_radius']
+             for cooling in SWEEP['COOLING_RATE']
+             for _ in range(BATCH_RUNS)]
+    seeds = np.random.SeedSequence(BATCH_SEED).generate_state(len(tasks))
+    tasks = [task + (int(seed),) for task, seed in zip(tasks, seeds)]
+
+    start = pytime.perf_counter()
+    with Pool() as pool:
+        results = pool.map(run_realization, tasks, chunksize=1)
+    elapsed = pytime.perf_counter() - start
+
+    heat = np.array([curve for curve, mass in results])
+    params = np.array([task[:3] for task in tasks])
+    np.savez_compressed(BATCH_FILE,
+                        time_points=dt * SUBSTEPS * np.arange(1, heat.shape[1] + 1),
+                        energy_accumulated=heat,
+                        final_mass=np.array([mass for curve, mass in results]),
+                        num_particles=params[:, 0].astype(int),
+                        absorption_radius=params[:, 1],
+                        cooling_rate=params[:, 2],
+                        seed=seeds)
+    print(f"{len(tasks)} realizaciones en {elapsed:.1f} s, guardadas en {BATCH_FILE}")
 
 #------------------------------------------------------------------------------------------------------------------------
 
-v_big_particle= math.sqrt(G * star_mass / 350) #Velocidad inicial del protoplaneta
-protoplanet = Particle(CENTER[0] + 350, CENTER[1], 0, v_big_particle, protoplanet_initial_mass, BROWN)
-particles = initialize_particles()
-
-# Inicializa el tiempo y registra los valores para la gráfica
-time = 0
-
-# Lista para registrar la energía cinética perdida acumulada y el tiempo
-time_points = []
-energy_accumulated = []
-
-
-running = True
-while running:
-    clock.tick(1000)
-    screen.fill(BLACK)
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-
-    # Subpasos de simulación
-    for _ in range(SUBSTEPS):
-        update_positions_and_velocities(particles, protoplanet)
-        absorb_particles(particles, protoplanet)
-    
-    #Enfriamiento del protoplaneta con el tiempo
-    protoplanet.cool_down(dt * SUBSTEPS)
-        
-    # Registrar energía acumulada y tiempo
-    time += dt * SUBSTEPS
-    time_points.append(time)
-    
-    # Asegurar que energy_accumulated crezca con time_points
-    if len(energy_accumulated) < len(time_points):
-        if energy_accumulated:
-            energy_accumulated.append(energy_accumulated[-1])
-        else:
-            energy_accumulated.append(0)  # Valor inicial si aún no hay energía
-            
-    # Dibujar
-    pygame.draw.circle(screen, YELLOW, CENTER, 30)
-    for p in particles:
-        p.draw(screen)
-    protoplanet.draw(screen)
-
-    pygame.display.flip()
-
-pygame.quit()
-
-# Generar la gráfica de energía acumulada vs tiempo
-plt.figure(figsize=(10, 6))
-plt.plot(time_points, energy_accumulated, label="Energía acumulada (calor)", color='red')
-plt.title("Relación entre Calor acumulado y Tiempo")
-plt.xlabel("Tiempo")
-plt.ylabel("Energía Acumulada")
-plt.legend()
-plt.grid()
-plt.show()
-
-sys.exit()
\ No newline at end of file
+# El modo por lotes no abre ventana; la protección de __main__ evita que los procesos del Pool
+# (que importan este fichero en Windows) vuelvan a ejecutar la simulación
+if __name__ == "__main__":
+    if BATCH:
+        run_batch()
+        sys.exit()
+
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Formación del protoplaneta")
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont("Arial", 18)
+
+    system = initialize_particles()
+    protoplanet = system.particle(PROTOPLANET, BROWN)
+
+    # Error de la fuerza de Barnes-Hut frente a la suma directa para varios theta
+    if SELF_GRAVITY:
+        for theta, error, elapsed in barnes_hut_error(system):
+            print(f"theta={theta:.2f}  error relativo={error:.2e}  tiempo={elapsed*1000:.1f} ms")
+
+    # Error relativo de energía del integrador en cada frame
+    energy_drift = []
+
+    # Deriva de energía y coste del integrador híbrido frente a RK4
+    if HYBRID:
+        for name, drift, evaluations in compare_integrators():
+            print(f"{name}: deriva relativa de energía={drift:.2e}  evaluaciones de fuerza={evaluations}")
+
+    # Inicializa el tiempo y el registro de absorciones para la gráfica
+    sim_time = 0
+    event_log = EventLog(EVENT_LOG)
+
+    running = True
+    while running:
+        clock.tick(1000)
+        screen.fill(BLACK)
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        # Subpasos de simulación
+        energy_drift.append(advance_frame(system))
+
+        #Enfriamiento del protoplaneta (y de los embriones) con el tiempo
+        system.cool_down(dt * SUBSTEPS)
+        protoplanet.update_color()
+
+        # Dibujar
+        pygame.draw.circle(screen, YELLOW, CENTER, 30)
+        draw_dust(screen, system)
+        protoplanet.draw(screen)
+
+        drift_text = (f"{INTEGRATOR}{' adaptativo' if ADAPTIVE else ''}  error de energía: {energy_drift[-1]:.2e}"
+                      f"  (acumulado {sum(energy_drift):.2e})")
+        screen.blit(font.render(drift_text, True, WHITE), (10, 10))
+
+        pygame.display.flip()
+
+    pygame.quit()
+    event_log.close()
+
+    # Generar la gráfica de energía acumulada vs tiempo a partir del registro de absorciones
+    events = read_event_log(EVENT_LOG)
+    events = events[events['body'] == PROTOPLANET]
+    print(f"{event_log.count} absorciones registradas en {EVENT_LOG}")
+    plt.figure(figsize=(10, 6))
+    heat = np.r_[0, events['heat']]
+    plt.step(np.r_[0, events['time'], sim_time], np.r_[heat, heat[-1]],
+             where='post', label="Energía acumulada (calor)", color='red')
+    plt.title("Relación entre Calor acumulado y Tiempo")
+    plt.xlabel("Tiempo")
+    plt.ylabel("Energía Acumulada")
+    plt.legend()
+    plt.grid()
+    plt.show()
+
+    sys.exit()
@@ -7,6 +7,12 @@ import pygame
 import sys
 import math
 import random
+import heapq
+import time
+import os
+import pickle
+import hashlib
+import numpy as np
 import matplotlib.pyplot as plt
 
 
@@ -41,9 +47,42 @@ VOLCANO_LAVA = (255,69,0)
 
 O2_THRESHOLD = 21.0
 
+# Cinética por eventos: cada molécula se mueve en línea recta hasta su próximo evento (pared, superficie,
+# escape o desaparición) y solo se procesan las que tienen un evento en el tick actual. En la etapa 2
+# (lluvia y océano creciendo) se vuelve al paso a paso de todas las moléculas
+EVENT_DRIVEN = False
+NEVER = 2**62
+
+# Modo poblacional: evoluciona solo el número de moléculas de cada especie, con saltos de tau-leaping
+# de POPULATION_TAU ticks (sorteos binomiales y multinomiales) y sin posiciones ni ventana.
+# POPULATION_SCALE multiplica todas las cantidades (moléculas iniciales, emisión, ajustes y células)
+POPULATION = False
+POPULATION_TICKS = 8000
+POPULATION_SCALE = 1
+POPULATION_TAU = 1
+
+# Semilla de los generadores aleatorios (None: aleatoria). Con semilla fija se guarda en STAGE_CACHE_DIR
+# el estado al empezar cada etapa, con una clave que resume la semilla y los parámetros de las etapas
+# anteriores; otra ejecución con la misma clave empieza directamente en la última etapa guardada (así se
+# prueban cambios de la etapa 3 sin repetir las demás). Si la caché pasa de STAGE_CACHE_LIMIT bytes se
+# borran las instantáneas usadas hace más tiempo
+SEED = None
+STAGE_CACHE = True
+STAGE_CACHE_DIR = "cache_etapas"
+STAGE_CACHE_LIMIT = 200 * 2**20
+
+# Perfiles de densidad por altura: en cada tick se cuentan las moléculas en el aire de cada especie en
+# PROFILE_BINS capas de altura sobre la corteza y se ajusta su altura de escala (n ∝ exp(-h/H)). Se
+# guardan los últimos PROFILE_HISTORY ticks y al terminar se escriben en PROFILE_FILE
+PROFILES = False
+PROFILE_BINS = 26
+PROFILE_HISTORY = 1000
+PROFILE_FILE = "perfiles_altura.npz"
+
 pygame.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Atmósfera - Mantener partículas, concentraciones estables")
+if not POPULATION:
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Atmósfera - Mantener partículas, concentraciones estables")
 clock = pygame.time.Clock()
 
 font = pygame.font.SysFont("Arial", 18)
@@ -61,132 +100,425 @@ GAS_COMPOSITION_STAGE_1 = {
     'SO2':0.015
 }
 
-class Particle:
-    def __init__(self, x, y, vx, vy, gas_type, color):
-        self.x = x
-        self.y = y
-        self.vx = vx
-        self.vy = vy
-        self.gas_type = gas_type
-        self.color = color
-        self.radius = 2
-        self.settled = False
-
-    def update(self, stage, elapsed_stage2):
-        if stage == 2 and self.gas_type == 'H2O' and not self.settled:
+# Moléculas que emite el volcán en cada tick de la etapa 1
+EMISSION_RATE = 10
+
+# Especies de gas: cada molécula guarda el código (índice) de su especie
+SPECIES = ['H2', 'He', 'H2O', 'CO2', 'N2', 'O2', 'CH4', 'SO2']
+SPECIES_CODE = {g: i for i, g in enumerate(SPECIES)}
+H2, He, H2O, CO2, N2, O2, CH4, SO2 = range(len(SPECIES))
+SPECIES_COLOR = np.array([COLOR_H2, COLOR_He, COLOR_H2O, COLOR_CO2, COLOR_N2, COLOR_O2, COLOR_CH4, COLOR_SO2],
+                         dtype=np.uint8)
+PARTICLE_RADIUS = 2
+DISC_X, DISC_Y = np.array([(ox, oy) for ox in range(-PARTICLE_RADIUS, PARTICLE_RADIUS + 1)
+                           for oy in range(-PARTICLE_RADIUS, PARTICLE_RADIUS + 1)
+                           if ox*ox + oy*oy <= PARTICLE_RADIUS**2]).T
+
+# Con más de DENSITY_THRESHOLD moléculas se dibuja el campo de densidad en vez de cada molécula:
+# histograma por especie en celdas de DENSITY_CELL píxeles, con el color medio de las especies de cada
+# celda y un brillo que se satura con DENSITY_SATURATION moléculas por celda
+DENSITY_THRESHOLD = 20000
+DENSITY_CELL = 4
+DENSITY_SATURATION = 8
+DENSITY_COLUMNS, DENSITY_ROWS = WIDTH // DENSITY_CELL, HEIGHT // DENSITY_CELL
+
+# Tabla acumulada de una composición: códigos de especie y probabilidades acumuladas (la última es 1)
+def composition_table(composition):
+    codes = np.array([SPECIES_CODE[g] for g in composition], dtype=np.int8)
+    cumulative = np.cumsum(list(composition.values()))
+    return codes, cumulative / cumulative[-1]
+
+# Sortear la especie de n moléculas de golpe con la tabla acumulada
+def sample_species(table, n):
+    codes, cumulative = table
+    return codes[np.searchsorted(cumulative, np.random.random(n))]
+
+STAGE_0_TABLE = composition_table(GAS_COMPOSITION_STAGE_0)
+STAGE_1_TABLE = composition_table(GAS_COMPOSITION_STAGE_1)
+
+# Almacén de las moléculas de gas en arrays de NumPy (posición, velocidad, especie y si está asentada).
+# Las altas se acumulan y las bajas se marcan durante el tick; commit() las aplica de una vez al final.
+# Lleva además la cuenta de moléculas por especie (y de las asentadas), al día en cada alta, baja o
+# asentamiento, para consultar la composición sin recorrer los arrays.
+# La posición guardada es la del tick t0; en el modo por eventos t0 puede quedar atrás (ver positions)
+class GasSystem:
+    FIELDS = ('x', 'y', 'vx', 'vy', 'species', 'settled', 't0', 'event', 'decay', 'ident')
+
+    def __init__(self):
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.vx = np.zeros(0)
+        self.vy = np.zeros(0)
+        self.species = np.zeros(0, dtype=np.int8)
+        self.settled = np.zeros(0, dtype=bool)
+        self.t0 = np.zeros(0, dtype=np.int64)      # Tick en el que son válidas x, y
+        self.event = np.zeros(0, dtype=np.int64)   # Tick del próximo evento (modo por eventos)
+        self.decay = np.zeros(0, dtype=np.int64)   # Tick en el que desaparece (modo por eventos)
+        self.ident = np.zeros(0, dtype=np.int64)   # Identificador fijo para la cola de eventos
+        self.dead = np.zeros(0, dtype=bool)
+        self.pending = []
+        self.counts = np.zeros(len(SPECIES), dtype=int)
+        self.settled_counts = np.zeros(len(SPECIES), dtype=int)
+        self.total = 0
+        self.time = -1  # Último tick procesado
+        self.stage = 0
+        self.next_ident = 0
+        self.queue = []  # Cola de prioridad de (tick, identificador)
+        self.row_of = np.zeros(0, dtype=np.int64)
+        self.scheduled = False
+
+    def __len__(self):
+        return len(self.x)
+
+    # Moléculas de una especie en el aire (sin contar las asentadas)
+    def airborne(self, species):
+        return self.counts[species] - self.settled_counts[species]
+
+    # Posiciones en el tick actual
+    def positions(self):
+        elapsed = self.time - self.t0
+        return self.x + self.vx * elapsed, self.y + self.vy * elapsed
+
+    # Añadir moléculas (escalares o arrays); se incorporan en commit()
+    def add(self, x, y, vx, vy, species):
+        x, y, vx, vy, species = np.broadcast_arrays(*map(np.atleast_1d, (x, y, vx, vy, species)))
+        n = x.size
+        self.pending.append((x.astype(float), y.astype(float), vx.astype(float), vy.astype(float),
+                             species.astype(np.int8), np.zeros(n, dtype=bool), np.full(n, self.time),
+                             np.full(n, NEVER), np.full(n, NEVER), np.arange(self.next_ident, self.next_ident + n)))
+        self.next_ident += n
+        self.counts += np.bincount(species, minlength=len(SPECIES))
+        self.total += species.size
+
+    # Marcar moléculas para eliminarlas (máscara o índices); las ya marcadas no se descuentan dos veces
+    def remove(self, which):
+        index = np.flatnonzero(which) if np.asarray(which).dtype == bool else np.asarray(which, dtype=int)
+        index = index[~self.dead[index]]
+        self.dead[index] = True
+        self.counts -= np.bincount(self.species[index], minlength=len(SPECIES))
+        self.settled_counts -= np.bincount(self.species[index[self.settled[index]]], minlength=len(SPECIES))
+        self.total -= index.size
+
+    # Índices de las n primeras moléculas vivas de una especie (en orden de llegada)
+    def first(self, species, n, mask=True):
+        return np.flatnonzero((self.species == species) & ~self.dead & mask)[:max(n, 0)]
+
+    # Una sola compactación por tick: quitar las bajas y añadir las altas
+    def commit(self):
+        if not self.pending and not self.dead.any():
+            return
+        keep = ~self.dead
+        kept = np.count_nonzero(keep)
+        for i, name in enumerate(self.FIELDS):
+            setattr(self, name, np.concatenate([getattr(self, name)[keep]] + [part[i] for part in self.pending]))
+        self.dead = np.zeros(len(self.x), dtype=bool)
+        self.pending = []
+        if self.scheduled:
+            self.row_of = np.full(self.next_ident, -1)
+            self.row_of[self.ident] = np.arange(len(self))
+            new = np.arange(kept, len(self))
+            self.sample_decay(new)
+            self.schedule(new)
+
+    # Rebotes en las paredes, el techo (salvo H2 y He, que escapan) y la superficie
+    def reflect(self, rows, surface):
+        x, y, vx, vy = self.x[rows], self.y[rows], self.vx[rows], self.vy[rows]
+        left = x < 0
+        x[left] = 0
+        vx[left] = -vx[left]
+        right = x > WIDTH
+        x[right] = WIDTH
+        vx[right] = -vx[right]
+        species = self.species[rows]
+        top = (y < 0) & (species != H2) & (species != He)
+        y[top] = 0
+        vy[top] = -vy[top]
+        bottom = (y > surface) & ~self.settled[rows]
+        y[bottom] = surface
+        vy[bottom] = -np.abs(vy[bottom])
+        self.x[rows], self.y[rows], self.vx[rows], self.vy[rows] = x, y, vx, vy
+
+    # Movimiento, precipitación y rebotes de todas las moléculas en una pasada
+    def update(self, stage, elapsed_stage2, now):
+        self.synchronize()
+        surface = CRUST_Y - ocean_thickness
+        water = (self.species == H2O) & ~self.settled
+        if stage == 2:
             # Incrementar la probabilidad de precipitación y que crezca más rápido
-            precipitation_prob = min(0.0005 + elapsed_stage2*1e-6, 0.002) 
-            if random.random() < precipitation_prob:
-                self.vy = 0.5
+            precipitation_prob = min(0.0005 + elapsed_stage2*1e-6, 0.002)
+            rain = water & (np.random.random(len(self)) < precipitation_prob)
+            self.vy[rain] = 0.5
 
         self.x += self.vx
         self.y += self.vy
-
-        if stage == 2 and self.gas_type == 'H2O' and not self.settled and self.y > CRUST_Y - ocean_thickness:
-            self.y = CRUST_Y - ocean_thickness
-            self.vx = 0
-            self.vy = 0
-            self.settled = True
+        self.t0[:] = now
+        self.time = now
+
+        if stage == 2:
+            settle = water & (self.y > surface)
+            self.y[settle] = surface
+            self.vx[settle] = 0
+            self.vy[settle] = 0
+            self.settled |= settle
+            self.settled_counts[H2O] += np.count_nonzero(settle)
         else:
-            if self.x < 0:
-                self.x = 0
-                self.vx = -self.vx
-            if self.x > WIDTH:
-                self.x = WIDTH
-                self.vx = -self.vx
-            if self.y < 0:
-                if self.gas_type not in ['H2','He']:
-                    self.y = 0
-                    self.vy = -self.vy
-            if self.y > CRUST_Y - ocean_thickness and not self.settled:
-                self.y = CRUST_Y - ocean_thickness
-                self.vy = -abs(self.vy)
-
+            settle = np.zeros(len(self), dtype=bool)
+
+        self.reflect(np.flatnonzero(~settle), surface)
+
+    # Volver al paso a paso: poner al día las posiciones y vaciar la cola
+    def synchronize(self):
+        if self.scheduled:
+            self.x, self.y = self.positions()
+            self.t0[:] = self.time
+            self.queue = []
+            self.scheduled = False
+
+    # Tick de desaparición de las moléculas que se desintegran en esta etapa (espera geométrica)
+    def sample_decay(self, rows):
+        p = decay_probabilities(self.stage)[self.species[rows]]
+        self.decay[rows] = NEVER
+        some = p > 0
+        self.decay[rows[some]] = self.t0[rows[some]] + np.random.geometric(p[some])
+
+    # Próximo evento de cada molécula: primer tick en el que cruza una pared, el techo o la superficie
+    # avanzando vx, vy por tick (como en update), o su desaparición si es antes
+    def schedule(self, rows):
+        surface = CRUST_Y - ocean_thickness
+        x, y, vx, vy = self.x[rows], self.y[rows], self.vx[rows], self.vy[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nx = np.where(vx < 0, np.floor(x / -vx) + 1, np.where(vx > 0, np.floor((WIDTH - x) / vx) + 1, np.inf))
+            ny = np.where(vy < 0, np.floor(y / -vy) + 1, np.where(vy > 0, np.floor((surface - y) / vy) + 1, np.inf))
+        steps = np.minimum(nx, ny)
+        steps[self.settled[rows]] = np.inf
+        motion = np.full(len(rows), NEVER)
+        finite = np.isfinite(steps)
+        motion[finite] = self.t0[rows[finite]] + steps[finite].astype(np.int64)
+        self.event[rows] = np.minimum(motion, self.decay[rows])
+        for tick, ident in zip(self.event[rows].tolist(), self.ident[rows].tolist()):
+            if tick < NEVER:
+                heapq.heappush(self.queue, (tick, ident))
+
+    # Tick del modo por eventos: procesar solo las moléculas con un evento pendiente.
+    # Devuelve las moléculas de CO2 que han desaparecido
+    def process_events(self, stage, now):
+        self.time, self.stage = now, stage
+        if not self.scheduled:
+            self.scheduled = True
+            self.queue = []
+            self.row_of = np.full(self.next_ident, -1)
+            self.row_of[self.ident] = np.arange(len(self))
+            everyone = np.arange(len(self))
+            self.sample_decay(everyone)
+            self.schedule(everyone)
+
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            tick, ident = heapq.heappop(self.queue)
+            row = self.row_of[ident] if ident < len(self.row_of) else -1
+            if row >= 0 and self.event[row] == tick:
+                due.append(row)
+        rows = np.unique(np.array(due, dtype=int))
+        rows = rows[~self.dead[rows]]
+
+        vanished = rows[self.decay[rows] <= now]
+        self.remove(vanished)
+        moving = rows[self.decay[rows] > now]
+        elapsed = now - self.t0[moving]
+        self.x[moving] += self.vx[moving] * elapsed
+        self.y[moving] += self.vy[moving] * elapsed
+        self.t0[moving] = now
+        self.reflect(moving, CRUST_Y - ocean_thickness)
+        escaped = ((self.species[moving] == H2) | (self.species[moving] == He)) & (self.y[moving] < 0)
+        self.remove(moving[escaped])
+        self.schedule(moving[~escaped])
+        return np.count_nonzero(self.species[vanished] == CO2)
+
+    # Dibujar todas las moléculas estampando un disco de radio 2 sobre los píxeles de la pantalla
+    # (o el campo de densidad si hay demasiadas)
     def draw(self, surface):
-        pygame.draw.circle(surface, self.color, (int(self.x), int(self.y)), self.radius)
+        if len(self) > DENSITY_THRESHOLD:
+            self.draw_density(surface)
+            return
+        colors = np.array([surface.map_rgb(tuple(c)) for c in SPECIES_COLOR], dtype=np.uint32)[self.species]
+        x, y = self.positions()
+        px = x.astype(int)[:, None] + DISC_X
+        py = y.astype(int)[:, None] + DISC_Y
+        visible = (px >= 0) & (px < WIDTH) & (py >= 0) & (py < HEIGHT)
+        index = (py * WIDTH + px)[visible]
+        colors = np.broadcast_to(colors[:, None], visible.shape)[visible]
+        pixels = pygame.surfarray.pixels2d(surface)
+        if pixels.flags.f_contiguous:
+            pixels.reshape(-1, order='F')[index] = colors
+        else:
+            pixels[index % WIDTH, index // WIDTH] = colors
+        del pixels
+
+    # Campo de densidad: un bincount por especie y celda, coloreado con la paleta y ampliado de una vez
+    def draw_density(self, surface):
+        x, y = self.positions()
+        column = np.clip((x * (1 / DENSITY_CELL)).astype(np.int32), 0, DENSITY_COLUMNS - 1)
+        row = np.clip((y * (1 / DENSITY_CELL)).astype(np.int32), 0, DENSITY_ROWS - 1)
+        cell = column * DENSITY_ROWS + row
+        size = DENSITY_COLUMNS * DENSITY_ROWS
+        counts = np.bincount(self.species.astype(np.int32) * size + cell, minlength=len(SPECIES) * size)
+        counts = counts.reshape(len(SPECIES), size).astype(np.float32)
+        total = counts.sum(0)
+        brightness = np.minimum(total / DENSITY_SATURATION, 1) / np.maximum(total, 1)
+        rgb = (counts.T @ SPECIES_COLOR.astype(np.float32)) * brightness[:, None]
+        image = pygame.surfarray.make_surface(rgb.reshape(DENSITY_COLUMNS, DENSITY_ROWS, 3).astype(np.uint8))
+        image.set_colorkey((0, 0, 0))
+        surface.blit(pygame.transform.scale(image, (DENSITY_COLUMNS * DENSITY_CELL, DENSITY_ROWS * DENSITY_CELL)),
+                     (0, 0))
+
+CELL_RADIUS = 5
 
 class Cell:
     def __init__(self, x, y):
         self.x = x
         self.y = y
-        self.radius = 5
+        self.radius = CELL_RADIUS
         self.color = (10, 120, 10)
 
     def draw(self, screen):
         pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), self.radius)
 
-class MineralDeposit:
-    def __init__(self, x, radius):
-        self.x = x
-        self.y = CRUST_Y
-        self.radius = radius
-
-    def draw(self, screen):
-        pygame.draw.circle(screen, COLOR_ROCK, (int(self.x), int(self.y)), self.radius)
-
-def check_collision(p1, p2):
-    dx = p1.x - p2.x
-    dy = p1.y - p2.y
-    dist = math.hypot(dx, dy)
-    return dist < (p1.radius + p2.radius)
-
-particles = []
+# Depósitos minerales: altura del sedimento en cada columna de píxeles de la corteza. Cada depósito es un
+# círculo centrado en la corteza, así que se estampa su perfil (la altura final es la de su unión)
+sediment = np.zeros(WIDTH)
+deposits_formed = 0
+SEDIMENT_COLUMNS = np.arange(WIDTH)
+
+def stamp_deposit(x, radius):
+    global deposits_formed
+    x = int(x)
+    first, last = max(int(x - radius), 0), min(int(x + radius) + 1, WIDTH)
+    offset = SEDIMENT_COLUMNS[first:last] - x
+    np.maximum(sediment[first:last], np.sqrt(np.clip(radius*radius - offset*offset, 0, None)),
+               out=sediment[first:last])
+    deposits_formed += 1
+
+# Dibujar el sedimento de una vez: en cada columna, los píxeles a menos de su altura de la corteza
+def draw_sediment(screen):
+    top = int(math.ceil(sediment.max()))
+    if top == 0:
+        return
+    rows = np.arange(CRUST_Y - top, min(CRUST_Y + top + 1, HEIGHT))
+    rock = np.abs(rows - CRUST_Y)[None, :] < sediment[:, None]
+    pixels = pygame.surfarray.pixels2d(screen)
+    band = pixels[:, rows[0]:rows[-1] + 1]
+    band[rock] = screen.map_rgb(COLOR_ROCK)
+    del band, pixels
+
+# Rejilla uniforme para los choques célula-CO2: casillas del tamaño de la distancia de contacto, así que
+# cada célula solo prueba las moléculas de su casilla y de las 8 vecinas
+CONTACT_DISTANCE = CELL_RADIUS + PARTICLE_RADIUS
+GRID_COLUMNS = int(WIDTH // CONTACT_DISTANCE) + 3
+
+def grid_key(x, y):
+    return (np.floor(y / CONTACT_DISTANCE).astype(int) * GRID_COLUMNS +
+            np.floor(x / CONTACT_DISTANCE).astype(int) + 1)
+
+# Para cada célula, la primera molécula de CO2 (en orden de llegada) con la que choca, o -1
+def check_collision(cells, atmosphere):
+    first_hit = np.full(len(cells), -1)
+    co2 = np.flatnonzero((atmosphere.species == CO2) & ~atmosphere.dead)
+    if len(cells) == 0 or len(co2) == 0:
+        return first_hit
+    x, y = atmosphere.positions()
+    keys = grid_key(x[co2], y[co2])
+    order = np.argsort(keys, kind='stable')
+    co2, keys = co2[order], keys[order]
+
+    cx = np.array([c.x for c in cells])
+    cy = np.array([c.y for c in cells])
+    neighbours = (grid_key(cx, cy)[:, None] +
+                  np.array([dy * GRID_COLUMNS + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1)]))
+    start = np.searchsorted(keys, neighbours, 'left').ravel()
+    end = np.searchsorted(keys, neighbours, 'right').ravel()
+    length = end - start
+    owner = np.repeat(np.repeat(np.arange(len(cells)), 9), length)
+    position = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length) + np.repeat(start, length)
+    candidate = co2[position]
+
+    touching = np.hypot(cx[owner] - x[candidate], cy[owner] - y[candidate]) < CONTACT_DISTANCE
+    owner, candidate = owner[touching], candidate[touching]
+    nearest = np.full(len(cells), len(atmosphere))
+    np.minimum.at(nearest, owner, candidate)
+    first_hit[nearest < len(atmosphere)] = nearest[nearest < len(atmosphere)]
+    return first_hit
+
+# Registro circular de perfiles: densidad (moléculas por píxel cuadrado) de cada especie en cada capa y
+# altura de escala ajustada (NaN si la especie no decrece con la altura)
+class ProfileRecorder:
+    def __init__(self, length=PROFILE_HISTORY, bins=PROFILE_BINS):
+        self.bins = bins
+        self.bin_height = CRUST_Y / bins
+        self.altitude = (np.arange(bins) + 0.5) * self.bin_height  # Altura del centro de cada capa
+        self.tick = np.full(length, -1, dtype=np.int64)
+        self.density = np.zeros((length, len(SPECIES), bins), dtype=np.float32)
+        self.scale_height = np.full((length, len(SPECIES)), np.nan, dtype=np.float32)
+        self.recorded = 0
+
+    # Un solo bincount con la clave especie*capas + capa; las moléculas asentadas o eliminadas van a una
+    # clave extra que se descarta
+    def record(self, tick, atmosphere):
+        y = atmosphere.positions()[1] if atmosphere.scheduled else atmosphere.y
+        layer = ((CRUST_Y - y) * (1 / self.bin_height)).astype(np.int32)
+        np.clip(layer, 0, self.bins - 1, out=layer)
+        key = atmosphere.species.astype(np.int32) * self.bins + layer
+        key[atmosphere.dead | atmosphere.settled] = len(SPECIES) * self.bins
+        counts = np.bincount(key, minlength=len(SPECIES) * self.bins + 1)[:-1].reshape(len(SPECIES), self.bins)
+
+        # Ajuste de log(n) frente a la altura por mínimos cuadrados pesados con n
+        w = counts.astype(float)
+        logn = np.log(np.where(counts > 0, counts, 1))
+        h = self.altitude
+        sw, swh, swhh = w.sum(1), w @ h, w @ (h * h)
+        swy, swhy = (w * logn).sum(1), (w * logn) @ h
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (sw * swhy - swh * swy) / (sw * swhh - swh * swh)
+            scale_height = np.where(slope < 0, -1 / slope, np.nan)
+
+        row = self.recorded % len(self.tick)
+        self.tick[row] = tick
+        self.density[row] = counts / (self.bin_height * WIDTH)
+        self.scale_height[row] = scale_height
+        self.recorded += 1
+
+    # Registros en orden de tiempo (el más antiguo primero)
+    def history(self):
+        order = np.arange(self.recorded - min(self.recorded, len(self.tick)), self.recorded) % len(self.tick)
+        return self.tick[order], self.density[order], self.scale_height[order]
+
+    def save(self, path=PROFILE_FILE):
+        tick, density, scale_height = self.history()
+        np.savez_compressed(path, tick=tick, density=density, scale_height=scale_height,
+                            altitude=self.altitude, species=np.array(SPECIES))
+
+atmosphere = GasSystem()
 cells = []
-mineral_deposits = []
 
 def generate_initial_stage_0_particles(num=2000):
-    for _ in range(num):
-        x = random.uniform(0, WIDTH)
-        y = random.uniform(0, CRUST_Y)
-        r = random.random()
-        cumulative = 0
-        gas_type = None
-        for g, perc in GAS_COMPOSITION_STAGE_0.items():
-            cumulative += perc
-            if r <= cumulative:
-                gas_type = g
-                break
-        color = COLOR_H2 if gas_type == 'H2' else COLOR_He
-        vx = random.uniform(-0.5,0.5)
-        vy = -abs(random.uniform(0.5,1.5))
-        p = Particle(x,y,vx,vy,gas_type,color)
-        particles.append(p)
-
-def emit_gases(stage):
+    x = np.random.uniform(0, WIDTH, num)
+    y = np.random.uniform(0, CRUST_Y, num)
+    vx = np.random.uniform(-0.5, 0.5, num)
+    vy = -np.abs(np.random.uniform(0.5, 1.5, num))
+    atmosphere.add(x, y, vx, vy, sample_species(STAGE_0_TABLE, num))
+    atmosphere.commit()
+
+# Emitir n moléculas del volcán a la vez (n puede ser de miles por tick)
+def emit_gases(stage, n=EMISSION_RATE):
     if stage != 1:
         return
-    comp = GAS_COMPOSITION_STAGE_1
-    speed = random.uniform(2,4)
-    angle = random.uniform(-math.pi/4, math.pi/4)
-    vx = speed*math.sin(angle)
-    vy = -abs(speed*math.cos(angle))
-    r = random.random()
-    cumulative=0
-    gas_type=None
-    for g,perc in comp.items():
-        cumulative+=perc
-        if r<=cumulative:
-            gas_type=g
-            break
-
-    if gas_type=='H2O':
-        color=COLOR_H2O
-    elif gas_type=='CO2':
-        color=COLOR_CO2
-    elif gas_type=='N2':
-        color=COLOR_N2
-    elif gas_type=='CH4':
-        color=COLOR_CH4
-    elif gas_type=='SO2':
-        color=COLOR_SO2
-    else:
-        color=(255,255,255)
-
-    p=Particle(VOLCANO_X,VOLCANO_TOP,vx,vy,gas_type,color)
-    particles.append(p)
+    speed = np.random.uniform(2, 4, n)
+    angle = np.random.uniform(-math.pi/4, math.pi/4, n)
+    vx = speed*np.sin(angle)
+    vy = -np.abs(speed*np.cos(angle))
+    atmosphere.add(VOLCANO_X, VOLCANO_TOP, vx, vy, sample_species(STAGE_1_TABLE, n))
 
 def form_ocean():
-    settled_count = sum(1 for p in particles if p.gas_type == 'H2O' and p.settled)
+    settled_count = atmosphere.settled_counts[H2O]
     global ocean_thickness
     # Incrementar el crecimiento del océano
     if settled_count > 0:
@@ -194,26 +526,17 @@ def form_ocean():
 
     # Eliminar más partículas asentadas por ciclo para acelerar la desaparición del agua gas
     max_particles_to_remove = random.randint(3,5) 
-    removed = 0
-    new_list = []
-    for p in particles:
-        if p.gas_type == 'H2O' and p.settled and removed < max_particles_to_remove:
-            removed += 1
-        else:
-            new_list.append(p)
-    return new_list
+    if settled_count > 0:
+        atmosphere.remove(atmosphere.first(H2O, max_particles_to_remove, atmosphere.settled))
 
-def calculate_o2_concentration(particles):
-    o2_count = sum(1 for p in particles if p.gas_type=='O2')
-    total = len(particles)
+def calculate_o2_concentration(atmosphere):
+    o2_count = atmosphere.counts[O2]
+    total = atmosphere.total
     return (o2_count/total*100.0) if total>0 else 0.0
 
-def count_gases(particles):
-    counts={'H2':0,'He':0,'H2O':0,'CO2':0,'N2':0,'O2':0,'CH4':0,'SO2':0}
-    for p in particles:
-        if p.gas_type in counts:
-            counts[p.gas_type]+=1
-    total=sum(counts.values())
+def count_gases(atmosphere):
+    counts = {g: int(atmosphere.counts[i]) for i, g in enumerate(SPECIES)}
+    total=atmosphere.total
     percentages={}
     if total>0:
         for g in counts:
@@ -223,11 +546,172 @@ def count_gases(particles):
             percentages[g]=0.0
     return percentages, counts, total
 
+# Probabilidad de desaparecer en cada tick de cada especie según la etapa
+def decay_probabilities(stage):
+    p = np.zeros(len(SPECIES))
+    if stage >= 1:
+        p[SO2] = so2_disappear_probability
+        p[CH4] = ch4_disappear_probability
+    if stage >= 2:
+        p[CO2] = co2_disappear_probability
+    return p
+
+# Fracción de las moléculas iniciales de H2/He que aún no han escapado tras t ticks
+# (parten de y uniforme en [0, CRUST_Y] y suben con |vy| uniforme en [0.5, 1.5])
+def escape_survival(t):
+    v_max = min(1.5, CRUST_Y / t) if t > 0 else 1.5
+    return max(v_max - 0.5 - t * (v_max**2 - 0.25) / (2 * CRUST_Y), 0.0)
+
+# |vy| de los gases del volcán (rapidez uniforme en [2, 4] y ángulo uniforme en [-pi/4, pi/4]),
+# en una rejilla para promediar sobre ellos
+def volcanic_vy():
+    speed, angle = np.meshgrid(np.linspace(2, 4, 21), np.linspace(-math.pi/4, math.pi/4, 21))
+    return (speed * np.cos(angle)).ravel()
+
+VOLCANIC_VY = volcanic_vy()
+
+# Fracción del vapor que aún no ha tocado la superficie tras t ticks de la etapa 2: cada molécula
+# rebota con |vy| constante y la toca una vez por viaje de ida y vuelta (2·altura/|vy|)
+def settle_survival(t, surface):
+    return np.mean(np.clip(1 - t * VOLCANIC_VY / (2 * surface), 0, 1))
+
+# Probabilidad por tick de que una molécula (de las que rebotan entre el techo y la superficie) esté en
+# contacto con una célula dada: la mitad del tiempo baja y pasa por la zona de contacto con densidad
+# uniforme; al tocar la superficie queda justo en ella un tick y, si |vy| < 2, el siguiente aún cerca
+def contact_probability(surface):
+    R, r = CONTACT_DISTANCE, CELL_RADIUS
+    segment = lambda d: d * math.sqrt(R*R - d*d) + R*R * math.asin(d / R)
+    area = segment(R) - segment(r)
+    bounce = 2 * math.sqrt(R*R - r*r) + np.where(VOLCANIC_VY < R - r,
+                                                 2 * np.sqrt(np.clip(R*R - (r + VOLCANIC_VY)**2, 0, None)), 0)
+    return area / (2 * WIDTH * surface) + np.mean(VOLCANIC_VY / (2 * surface) * bounce / WIDTH)
+
+# Simulación poblacional con la misma lógica de etapas; devuelve la evolución de las concentraciones
+def run_population(ticks=POPULATION_TICKS, scale=POPULATION_SCALE, tau=POPULATION_TAU):
+    global ocean_thickness, mineral_deposits_count
+    evolution = {'time': []}
+    evolution.update({g: [] for g in SPECIES})
+    counts = np.zeros(len(SPECIES), dtype=np.int64)
+    counts[[H2, He]] = np.random.multinomial(2000 * scale, [GAS_COMPOSITION_STAGE_0[g] for g in ('H2', 'He')])
+    emission, cumulative = STAGE_1_TABLE
+    emission_p = np.diff(cumulative, prepend=0)
+    raining = settled = cells = 0
+    landing = np.zeros(ticks + 2 * CRUST_Y + tau + 2, dtype=np.int64)  # Gotas de lluvia que llegan en cada tick
+    production = True
+    stage = 0
+
+    def percentages():
+        total = counts.sum()
+        return counts * 100.0 / total if total > 0 else np.zeros(len(SPECIES)), total
+
+    def leap(n, p):
+        return np.random.binomial(n, 1 - (1 - p)**tau)
+
+    for t in range(0, ticks, tau):
+        if stage == 0 and t >= STAGE_0_DURATION:
+            stage = 1
+        elif stage == 1 and t >= STAGE_0_DURATION + STAGE_1_DURATION:
+            stage = 2
+        elapsed_stage2 = t - (STAGE_0_DURATION + STAGE_1_DURATION) if stage == 2 else 0
+        surface = CRUST_Y - ocean_thickness
+
+        if stage == 1:
+            np.add.at(counts, emission, np.random.multinomial(EMISSION_RATE * scale * tau, emission_p))
+
+        # Escape de H2/He con la probabilidad condicionada a no haber escapado antes
+        if counts[H2] + counts[He] > 0:
+            before, after = escape_survival(t), escape_survival(t + tau)
+            for g in (H2, He):
+                counts[g] -= np.random.binomial(counts[g], 1 - after / before) if before > 0 else counts[g]
+
+        # Lluvia y asentamiento en la superficie: el vapor que rebota la toca según settle_survival y
+        # el que llueve cae a 0.5 desde una altura uniforme, así que llega en un tick uniforme de [1, 2·altura]
+        if stage == 2:
+            moving = counts[H2O] - raining - settled
+            rain = leap(moving, min(0.0005 + elapsed_stage2*1e-6, 0.002))
+            before = settle_survival(elapsed_stage2, surface)
+            after = settle_survival(elapsed_stage2 + tau, surface)
+            hit = np.random.binomial(moving - rain, 1 - after / before) if before > 0 else moving - rain
+            np.add.at(landing, t + np.random.randint(1, int(2 * surface) + 1, size=rain), 1)
+            land = landing[t + 1:t + tau + 1].sum()
+            raining += rain - land
+            settled += hit + land
+
+        if stage >= 1:
+            counts[SO2] -= leap(counts[SO2], so2_disappear_probability)
+            counts[CH4] -= leap(counts[CH4], ch4_disappear_probability)
+
+        if stage == 2:
+            if settled > 0:
+                ocean_thickness += 0.03 * tau
+            removed = min(settled, np.random.randint(3, 6, size=tau * scale).sum())
+            settled -= removed
+            counts[H2O] -= removed
+            pct, total = percentages()
+            if counts[H2O] - settled == 0 and pct[H2O] <= 1.0:
+                stage = 3
+
+        pct, total = percentages()
+
+        if stage >= 2:
+            vanished = leap(counts[CO2], co2_disappear_probability)
+            counts[CO2] -= vanished
+            mineral_deposits_count += 0.5 * vanished
+
+            # Ajuste N2 (como en el modo de partículas)
+            if pct[N2] < 77.5 or pct[N2] > 80.0:
+                desired_n2_count = int(0.78 * total)
+                max_step = 2 * scale * tau
+                if pct[N2] < 77.5:
+                    scaled_diff = max(int((77.5 - pct[N2]) * total / 200), 1)
+                    counts[N2] += max(min(desired_n2_count - counts[N2], scaled_diff, max_step), 0)
+                else:
+                    scaled_diff = max(int((pct[N2] - 80.0) * total / 200), 1)
+                    counts[N2] -= max(min(counts[N2] - desired_n2_count, scaled_diff, max_step), 0)
+
+        if stage == 3:
+            spawns = sum(1 for u in range(t, t + tau)
+                         if u > CELL_START_DELAY and (u - CELL_START_DELAY) % CELL_SPAWN_INTERVAL == 0)
+            cells = min(cells + spawns * scale, MAX_CELLS * scale)
+
+            # Cada célula produce O2 si toca al menos una molécula de CO2 (con la densidad de CO2 de la
+            # simulación original, es decir, como si el área creciera con POPULATION_SCALE)
+            if production:
+                touch = 1 - math.exp(-counts[CO2] / scale * contact_probability(surface))
+                counts[O2] += np.random.binomial(cells * tau, touch)
+            if percentages()[0][O2] >= O2_THRESHOLD:
+                production = False
+
+            pct, total = percentages()
+            if total > 0:
+                step = 2 * scale * tau
+                desired_h2o_count = int(0.01 * total)
+                if counts[H2O] > desired_h2o_count:
+                    removed = min(counts[H2O] - desired_h2o_count, step)
+                    counts[H2O] -= removed
+                    settled = max(settled - removed, 0)
+                else:
+                    counts[H2O] += min(desired_h2o_count - counts[H2O], step)
+                pct, total = percentages()
+                if pct[CO2] < 1.0:
+                    counts[CO2] += max(min(int(0.01 * total) - counts[CO2], step), 0)
+
+        pct, total = percentages()
+        evolution['time'].append(t)
+        for g in SPECIES:
+            evolution[g].append(pct[SPECIES_CODE[g]])
+    return evolution
+
 stage=0
 ocean_formed=False
 o2_production_enabled=True
 
-generate_initial_stage_0_particles(num=2000)
+if SEED is not None:
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+if not POPULATION:
+    generate_initial_stage_0_particles(num=2000)
 
 CELL_START_DELAY=300
 CELL_SPAWN_INTERVAL=60
@@ -243,18 +727,105 @@ mineral_deposits_count = 0
 # Variables adicionales para el registro de concentraciones
 gas_evolution = {'time': [], 'H2': [], 'He': [], 'H2O': [], 'CO2': [], 'N2': [], 'O2': [], 'CH4': [], 'SO2': []}
 
-running=True
+# Parámetros de los que depende el estado al empezar cada etapa (los de las etapas anteriores)
+UPSTREAM_PARAMETERS = {1: ('WIDTH', 'HEIGHT', 'CRUST_HEIGHT', 'STAGE_0_DURATION', 'GAS_COMPOSITION_STAGE_0',
+                           'EVENT_DRIVEN')}
+UPSTREAM_PARAMETERS[2] = UPSTREAM_PARAMETERS[1] + ('STAGE_1_DURATION', 'GAS_COMPOSITION_STAGE_1', 'EMISSION_RATE',
+                                                   'VOLCANO_X', 'VOLCANO_TOP', 'ch4_disappear_probability',
+                                                   'so2_disappear_probability')
+UPSTREAM_PARAMETERS[3] = UPSTREAM_PARAMETERS[2] + ('co2_disappear_probability',)
+
+def snapshot_path(stage):
+    values = [SEED, stage] + [globals()[name] for name in UPSTREAM_PARAMETERS[stage]]
+    key = hashlib.sha256(repr(values).encode()).hexdigest()[:32]
+    return os.path.join(STAGE_CACHE_DIR, f"etapa{stage}_{key}.pkl")
+
+# Estado al empezar un tick (lo necesario para repetirlo igual). Del registro de concentraciones solo se
+# apunta la longitud, porque únicamente crece
+def capture_state():
+    return pickle.dumps({'atmosphere': vars(atmosphere), 'time_steps': time_steps, 'stage': stage,
+                         'ocean_thickness': ocean_thickness, 'ocean_formed': ocean_formed,
+                         'mineral_deposits_count': mineral_deposits_count, 'sediment': sediment.copy(),
+                         'deposits_formed': deposits_formed,
+                         'records': len(gas_evolution['time']),
+                         'random': random.getstate(), 'numpy': np.random.get_state()})
+
+# Guardar en la caché el estado al empezar el tick en el que empieza una etapa
+def save_stage_snapshot(state, new_stage):
+    state = pickle.loads(state)
+    state['gas_evolution'] = {g: v[:state['records']] for g, v in gas_evolution.items()}
+    os.makedirs(STAGE_CACHE_DIR, exist_ok=True)
+    with open(snapshot_path(new_stage), 'wb') as f:
+        pickle.dump(state, f)
+    evict_snapshots()
+
+# Borrar las instantáneas usadas hace más tiempo (la fecha de modificación marca el último uso)
+def evict_snapshots():
+    files = [os.path.join(STAGE_CACHE_DIR, f) for f in os.listdir(STAGE_CACHE_DIR) if f.endswith('.pkl')]
+    files.sort(key=os.path.getmtime)
+    size = sum(os.path.getsize(f) for f in files)
+    while files and size > STAGE_CACHE_LIMIT:
+        oldest = files.pop(0)
+        size -= os.path.getsize(oldest)
+        os.remove(oldest)
+
+# Instantánea de la etapa más avanzada guardada con la configuración actual, o None
+def load_stage_snapshot():
+    for stage in (3, 2, 1):
+        path = snapshot_path(stage)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+            os.utime(path)
+            return state
+    return None
+
+stage_cache = SEED is not None and STAGE_CACHE and not POPULATION
+if stage_cache:
+    snapshot = load_stage_snapshot()
+    if snapshot is not None:
+        atmosphere.__dict__.update(snapshot['atmosphere'])
+        sediment[:] = snapshot['sediment']
+        deposits_formed = snapshot['deposits_formed']
+        random.setstate(snapshot['random'])
+        np.random.set_state(snapshot['numpy'])
+        time_steps, stage = snapshot['time_steps'], snapshot['stage']
+        ocean_thickness, ocean_formed = snapshot['ocean_thickness'], snapshot['ocean_formed']
+        mineral_deposits_count = snapshot['mineral_deposits_count']
+        gas_evolution = snapshot['gas_evolution']
+        print(f"Reanudando desde la instantánea guardada en el tick {time_steps}")
+
+# En el modo poblacional no hay partículas ni ventana: se calcula la evolución y se pasa a la gráfica
+if POPULATION:
+    start = time.perf_counter()
+    gas_evolution = run_population()
+    print(f"Modo poblacional: {POPULATION_TICKS} ticks en {time.perf_counter() - start:.2f} s")
+
+profiles = ProfileRecorder() if PROFILES and not POPULATION else None
+
+running=not POPULATION
 while running:
     dt=clock.tick(FPS)
     for event in pygame.event.get():
         if event.type==pygame.QUIT:
             running=False
 
-    # Avanzar etapa 
+    # Avanzar etapa (se decide al empezar el tick; la etapa 2 termina cuando el tick anterior ha dejado
+    # el H2O condensado y por debajo del 1%)
+    new_stage = stage
     if stage==0 and time_steps>=STAGE_0_DURATION:
-        stage=1
+        new_stage=1
     elif stage==1 and time_steps>=STAGE_0_DURATION+STAGE_1_DURATION:
-        stage=2
+        new_stage=2
+    elif stage==2 and atmosphere.airborne(H2O) == 0 and count_gases(atmosphere)[0]['H2O'] <= 1.0:
+        new_stage=3
+
+    # Guardar en la caché el estado al empezar el tick en el que cambia la etapa
+    if stage_cache and new_stage != stage:
+        save_stage_snapshot(capture_state(), new_stage)
+    if new_stage == 3:
+        ocean_formed = True
+    stage = new_stage
 
     # Calcular el tiempo transcurrido en etapa 2
     elapsed_stage2 = 0
@@ -263,55 +834,37 @@ while running:
 
     if stage==1:
         # Emitir gases en etapa 1
-        for _ in range(10):
-            emit_gases(stage)
+        emit_gases(stage)
 
-    particles_to_remove=[]
-    for p in particles:
-        p.update(stage, elapsed_stage2)
-        if (p.gas_type in ['H2','He']) and p.y<0:
-            particles_to_remove.append(p)
-    for pr in particles_to_remove:
-        particles.remove(pr)
+    if EVENT_DRIVEN and stage != 2:
+        co2_decayed = atmosphere.process_events(stage, time_steps)
+    else:
+        co2_decayed = None
+        atmosphere.update(stage, elapsed_stage2, time_steps)
+        atmosphere.remove(((atmosphere.species == H2) | (atmosphere.species == He)) & (atmosphere.y < 0))
 
-    if stage >= 1:
-        new_particles = []
-        for p in particles:
-            vanish = False
-            if p.gas_type == 'SO2' and random.random() < so2_disappear_probability:
-                vanish = True
-            elif p.gas_type == 'CH4' and random.random() < ch4_disappear_probability:
-                vanish = True
-            if not vanish:
-                new_particles.append(p)
-        particles = new_particles
+        if stage >= 1:
+            draw = np.random.random(len(atmosphere))
+            atmosphere.remove((atmosphere.species == SO2) & (draw < so2_disappear_probability))
+            atmosphere.remove((atmosphere.species == CH4) & (draw < ch4_disappear_probability))
 
     # Ajustes en etapa 2: formación de océano
     if stage == 2:
-        particles = form_ocean()
-        gas_percentages, counts, total = count_gases(particles)
-        h2o_in_air = any(p.gas_type == 'H2O' and not p.settled for p in particles)
-        # Mantener etapa 2 hasta que el porcentaje de H2O gas sea <= 1%
-        if not h2o_in_air and gas_percentages['H2O'] <= 1.0:
-            stage = 3
-            ocean_formed = True
-
-    gas_percentages, counts, total = count_gases(particles)   
+        form_ocean()
+
+    gas_percentages, counts, total = count_gases(atmosphere)   
          
     if stage >= 2:
-        new_particles = []
-        co2_vanished = 0
-        for p in particles:
-            vanish = (p.gas_type == 'CO2' and random.random() < co2_disappear_probability)
-            if vanish:
-                co2_vanished += 0.5
-            else:
-                new_particles.append(p)
-        particles = new_particles
+        if co2_decayed is None:
+            draw = np.random.random(len(atmosphere))
+            vanish = (atmosphere.species == CO2) & ~atmosphere.dead & (draw < co2_disappear_probability)
+            atmosphere.remove(vanish)
+            co2_decayed = np.count_nonzero(vanish)
+        co2_vanished = 0.5 * co2_decayed
         if co2_vanished>0:
             x = random.uniform(0, WIDTH)
             radius = 2 + co2_vanished
-            mineral_deposits.append(MineralDeposit(x, radius))
+            stamp_deposit(x, radius)
         mineral_deposits_count += co2_vanished
 
         # Ajuste N2
@@ -336,21 +889,14 @@ while running:
                     x = random.uniform(0, WIDTH)
                     y = random.uniform(0, CRUST_Y)
                     vx, vy = random.uniform(-0.5, 0.5), random.uniform(-0.5, 0.5)
-                    particles.append(Particle(x, y, vx, vy, 'N2', COLOR_N2))
+                    atmosphere.add(x, y, vx, vy, N2)
     
             elif n2_current > desired_n2_max:
                 diff = n2_current - desired_n2_max
                 scaled_diff = int(diff * total / 200)
                 scaled_diff = max(scaled_diff, 1)
                 to_remove = min(counts['N2'] - desired_n2_count, scaled_diff, max_step)
-    
-                newp = []
-                for p in particles:
-                    if to_remove > 0 and p.gas_type == 'N2':
-                        to_remove -= 1
-                    else:
-                        newp.append(p)
-                particles = newp  
+                atmosphere.remove(atmosphere.first(N2, to_remove))
     
     if stage==3:
         if time_steps>CELL_START_DELAY and cells_spawned<MAX_CELLS:
@@ -361,16 +907,14 @@ while running:
                 cells.append(Cell(x,y))
                 cells_spawned+=1
         
-        for c in cells:
-            for p in particles:
-                if p.gas_type=='CO2' and check_collision(c,p):
-                    if o2_production_enabled and random.random()<1:# podemos ajustar la producción de O2
-                        px,py=p.x,p.y
-                        vx,vy=random.uniform(-0.5,0.5),random.uniform(-0.5,-1)
-                        particles.append(Particle(px,py,vx,vy,'O2',COLOR_O2))
-                    break
-
-        o2_concentration=calculate_o2_concentration(particles)
+        hit = check_collision(cells, atmosphere)
+        hit = hit[hit >= 0]
+        if o2_production_enabled and len(hit) > 0:# podemos ajustar la producción de O2
+            vx,vy=np.random.uniform(-0.5,0.5,len(hit)),np.random.uniform(-0.5,-1,len(hit))
+            px,py=atmosphere.positions()
+            atmosphere.add(px[hit],py[hit],vx,vy,O2)
+
+        o2_concentration=calculate_o2_concentration(atmosphere)
         if o2_concentration>=O2_THRESHOLD:
             o2_production_enabled=False
 
@@ -383,21 +927,15 @@ while running:
                 step=2
                 if current_h2o_count>desired_h2o_count:
                     to_remove=min(current_h2o_count-desired_h2o_count,step)
-                    newp=[]
-                    for p in particles:
-                        if to_remove>0 and p.gas_type=='H2O':
-                            to_remove-=1
-                        else:
-                            newp.append(p)
-                    particles=newp
+                    atmosphere.remove(atmosphere.first(H2O, to_remove))
                 elif current_h2o_count<desired_h2o_count:
                     to_add=min(desired_h2o_count-current_h2o_count,step)
                     for _ in range(to_add):
                         x=random.uniform(0,WIDTH)
                         y=random.uniform(0,CRUST_Y)
                         vx,vy=random.uniform(-0.5,0.5),random.uniform(-0.5,0.5)
-                        particles.append(Particle(x,y,vx,vy,'H2O',COLOR_H2O))
-                gas_percentages, counts, total = count_gases(particles)
+                        atmosphere.add(x,y,vx,vy,H2O)
+                gas_percentages, counts, total = count_gases(atmosphere)
 
             # CO2 >=1%
             if gas_percentages['CO2']<1.0:
@@ -410,15 +948,21 @@ while running:
                     x=random.uniform(0,WIDTH)
                     y=random.uniform(0,CRUST_Y)
                     vx,vy=random.uniform(-0.5,0.5),random.uniform(-0.5,0.5)
-                    particles.append(Particle(x,y,vx,vy,'CO2',COLOR_CO2))
-                gas_percentages, counts, total = count_gases(particles)
+                    atmosphere.add(x,y,vx,vy,CO2)
+                gas_percentages, counts, total = count_gases(atmosphere)
 
-    gas_percentages, counts, total = count_gases(particles)
+    # Altas y bajas del tick aplicadas de una vez
+    atmosphere.commit()
+
+    gas_percentages, counts, total = count_gases(atmosphere)
     gas_evolution['time'].append(time_steps)
     for gas in gas_evolution.keys():
         if gas != 'time':
             gas_evolution[gas].append(gas_percentages[gas])
 
+    if profiles is not None:
+        profiles.record(time_steps, atmosphere)
+
     # Dibujar
     screen.fill((0,0,30))
     pygame.draw.rect(screen,(139,69,19),(0,CRUST_Y,WIDTH,CRUST_HEIGHT))
@@ -433,19 +977,17 @@ while running:
         pygame.draw.rect(screen,OCEAN_COLOR,(0,ocean_y,WIDTH,ocean_thickness))
         pygame.draw.line(screen,(200,200,200),(0,ocean_y),(WIDTH,ocean_y),1)
 
-    for p in particles:
-        p.draw(screen)
-    for rock in mineral_deposits:
-        rock.draw(screen)
+    atmosphere.draw(screen)
+    draw_sediment(screen)
     if stage==3:
         for c in cells:
             c.draw(screen)
 
-    gas_percentages, counts, total = count_gases(particles)
+    gas_percentages, counts, total = count_gases(atmosphere)
     text_lines=[]
     for g in ['H2','He','H2O','CO2','N2','O2','CH4','SO2']:
         text_lines.append(f"{g}: {gas_percentages[g]:.2f}%")
-    text_lines.append(f"Depositos minerales: {len(mineral_deposits)}")
+    text_lines.append(f"Depositos minerales: {deposits_formed}")
 
     # Dibujar la etapa actual en pantalla con un marco oscuro
     stage_text = f"Etapa: {stage}"
@@ -488,6 +1030,9 @@ while running:
 
 pygame.quit()
 
+if profiles is not None:
+    profiles.save()
+
 def norm_color(c):
     return (c[0]/255.0, c[1]/255.0, c[2]/255.0)
 
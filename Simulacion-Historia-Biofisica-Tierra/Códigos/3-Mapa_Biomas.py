@@ -5,9 +5,14 @@ Created on Fri Dec 13 16:48:43 2024
 @author: Usuario
 """
 import pygame
+import os
+import time
+import hashlib
+import shutil
 import numpy as np
-import noise
 import matplotlib.pyplot as plt
+from collections import OrderedDict
+from multiprocessing import Pool, shared_memory
 
 # Configuración inicial
 WIDTH, HEIGHT = 1200, 700
@@ -15,6 +20,44 @@ CELL_SIZE = 3
 GRID_WIDTH = WIDTH // CELL_SIZE
 GRID_HEIGHT = HEIGHT // CELL_SIZE
 
+# Mundo infinito por teselas de TILE_SIZE x TILE_SIZE celdas que se generan al acercarse la vista
+# (ruido, clima, biomas y píxeles) y se guardan en una caché LRU de hasta TILE_CACHE_BYTES bytes.
+# Como el ruido no se puede normalizar con el mínimo y el máximo de un mapa infinito, se usa el rango
+# típico de los mapas de la ventana (±TILE_NOISE_RANGE). Se mueve con las flechas o arrastrando el ratón
+TILED_WORLD = False
+TILE_SIZE = 64
+TILE_CACHE_BYTES = 256 * 2**20
+TILE_BUDGET = 0.008  # Segundos por frame dedicados a generar teselas
+TILE_NOISE_RANGE = 0.435
+PAN_SPEED = 12  # Píxeles por frame
+FPS = 60
+
+# Generación en paralelo del mapa fijo: a partir de PARALLEL_MIN_CELLS celdas el mapa se reparte en
+# bandas de filas entre WORKERS procesos, que escriben en arrays de memoria compartida
+WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_CELLS = 2_000_000
+BANDS_PER_WORKER = 4
+
+# Caché en disco del mapa fijo: altitud, temperatura, humedad y biomas se guardan como .npy en una carpeta
+# de WORLD_CACHE_DIR por cada (semilla, escala, octavas, persistencia, lacunaridad, tamaño) y se abren
+# mapeados en memoria (sin leerlos enteros). Temperatura, humedad y biomas llevan además en el nombre un
+# resumen de CLIMATE_PARAMS y BIOME_THRESHOLDS. WORLD_SEED fija la semilla (None: aleatoria). Si la caché
+# pasa de WORLD_CACHE_LIMIT bytes se borran los mundos abiertos hace más tiempo
+WORLD_SEED = None
+WORLD_CACHE = True
+WORLD_CACHE_DIR = "cache_mundos"
+WORLD_CACHE_LIMIT = 2 * 2**30
+
+# Clasificación por tabla: la altitud normalizada se cuantiza a 16 bits y, como temperatura y humedad solo
+# dependen de la altitud, el bioma de cada uno de los QUANT_LEVELS niveles se calcula una vez por juego de
+# parámetros; clasificar el mapa es indexar esa tabla. Los umbrales se ajustan con deslizadores en pantalla
+# (mapa fijo; la tecla H los oculta)
+QUANT_LEVELS = 2**16
+SLIDERS = [
+    ('deep_water', 0, 1), ('shallow_water', 0, 1), ('beach', 0, 1), ('meadow', 0, 1), ('meadow_humidity', 0, 100),
+    ('forest', 0, 1), ('forest_humidity', 0, 100), ('forest_temperature', -20, 30), ('mountain', 0, 1),
+]
+
 # Colores de biomas
 COLORS = {
     "deep_water": (0, 0, 128), #Aguas profundas
@@ -26,27 +69,89 @@ COLORS = {
     "snow": (255, 250, 250), #Nieve
 }
 
-# Inicializar Pygame
-pygame.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Mundo Procedural Biofísico")
+# Los biomas se guardan como códigos uint8: índice en BIOMES (nombre) y en BIOME_COLORS (color)
+BIOMES = list(COLORS)
+BIOME_CODE = {name: code for code, name in enumerate(BIOMES)}
+BIOME_COLORS = np.array([COLORS[name] for name in BIOMES], dtype=np.uint8)
+
+# Gradientes del ruido Perlin 2D (componentes x, y de los 16 gradientes de Ken Perlin)
+GRADIENT_X = np.array([1, -1, 1, -1, 1, -1, 1, -1, 0, 0, 0, 0, 1, -1, 0, 0], dtype=np.float32)
+GRADIENT_Y = np.array([1, 1, -1, -1, 0, 0, 0, 0, 1, -1, 1, -1, 0, 0, -1, 1], dtype=np.float32)
+NOISE_TILE = 64  # Columnas de la rejilla que se calculan en cada producto de matrices
+
+# Tabla de permutación (duplicada para no tener que dar la vuelta) de cada semilla
+def permutation_table(base):
+    perm = np.random.RandomState(base).permutation(256)
+    return np.concatenate([perm, perm])
+
+# Gradiente de cada nudo de la red (índices 0..255 en x e y), con el mismo hash que noise.pnoise2
+def gradient_tables(perm):
+    lattice = np.arange(256)
+    h = perm[perm[perm[lattice][:, None] + lattice[None, :]]] & 15
+    return GRADIENT_X[h], GRADIENT_Y[h]
+
+# Nudos de la red a izquierda y derecha de cada coordenada, su distancia al de la izquierda y el peso
+# (curva de suavizado) del de la derecha
+def lattice_axis(x, repeat):
+    i = np.floor(np.fmod(x, repeat)).astype(int)
+    ii = np.fmod(i + 1, repeat).astype(int) & 255
+    d = (x - np.floor(x)).astype(np.float32)
+    return i & 255, ii, d, d*d*d * (d * (d * 6 - 15) + 10)
+
+# Ruido fBm (suma de octavas) con los mismos parámetros que noise.pnoise2, evaluado sobre toda la rejilla
+# x por y a la vez; devuelve un array (len(x), len(y)).
+# El ruido de una octava es separable: sum_esquinas wx·wy·(dx·gx + dy·gy). Se contrae primero el eje x
+# contra la tabla de gradientes y después, por bandas de NOISE_TILE columnas, el eje y con un producto de
+# matrices que suma todas las octavas de una vez
+def perlin_noise(x, y, octaves=1, persistence=0.5, lacunarity=2.0, repeatx=1024, repeaty=1024, base=0):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    gx, gy = gradient_tables(permutation_table(base))
+    max_amp = sum(persistence**k for k in range(octaves))
+    x_terms, y_terms = [], []
+    freq, amp = 1.0, 1.0
+    for _ in range(octaves):
+        i, ii, dx, fx = lattice_axis(x * freq, repeatx * freq)
+        w = np.float32(amp / max_amp)
+        along_x = ((w * (1 - fx) * dx)[:, None] * gx[i] + (w * fx * (dx - 1))[:, None] * gx[ii])
+        along_y = ((w * (1 - fx))[:, None] * gy[i] + (w * fx)[:, None] * gy[ii])
+        x_terms.append((np.ascontiguousarray(along_x.T), np.ascontiguousarray(along_y.T)))
+        y_terms.append(lattice_axis(y * freq, repeaty * freq))
+        freq *= lacunarity
+        amp *= persistence
+
+    world = np.empty((len(y), len(x)), dtype=np.float32)  # Traspuesto: cada banda son filas contiguas
+    for start in range(0, len(y), NOISE_TILE):
+        end = min(start + NOISE_TILE, len(y))
+        n = end - start
+        band = np.arange(n)
+        left, right = [], []
+        for (along_x, along_y), (j, jj, dy, fy) in zip(x_terms, y_terms):
+            j, jj, dy, fy = j[start:end], jj[start:end], dy[start:end], fy[start:end]
+            nodes, corner = np.unique(np.concatenate([j, jj]), return_inverse=True)
+            weights = np.zeros((n, 2 * len(nodes)), dtype=np.float32)
+            np.add.at(weights, (band, corner[:n]), 1 - fy)
+            np.add.at(weights, (band, corner[n:]), fy)
+            np.add.at(weights, (band, len(nodes) + corner[:n]), (1 - fy) * dy)
+            np.add.at(weights, (band, len(nodes) + corner[n:]), fy * (dy - 1))
+            left.append(weights)
+            right += [along_x[nodes], along_y[nodes]]
+        np.matmul(np.hstack(left), np.vstack(right), out=world[start:end])
+    return world.T
 
 # Creamos la función de ruido Perlin
-def generate_perlin_world(grid_width, grid_height, scale=80):
-    world = np.zeros((grid_width, grid_height)) #Matriz del tamaño de la ventana
-    seed = np.random.randint(0, 100)  # Semilla aleatoria
-    for x in range(grid_width):
-        for y in range(grid_height):
-            world[x][y] = noise.pnoise2(
-                x / scale, #Coordenadas escaladas 
-                y / scale,
-                octaves=6, #Octavas o capas de ruido
-                persistence=0.5, #Reduce la amplitud
-                lacunarity=2.0, #Aumenta la frecuencia
-                repeatx=grid_width,
-                repeaty=grid_height,
-                base=seed,
-            )
+def generate_perlin_world(grid_width, grid_height, scale=80, octaves=6, persistence=0.5, lacunarity=2.0, seed=None):
+    if seed is None:
+        seed = np.random.randint(0, 100)  # Semilla aleatoria
+    world = perlin_noise(
+        np.arange(grid_width) / scale, #Coordenadas escaladas
+        np.arange(grid_height) / scale,
+        octaves=octaves, #Octavas o capas de ruido
+        persistence=persistence, #Reduce la amplitud
+        lacunarity=lacunarity, #Aumenta la frecuencia
+        repeatx=grid_width,
+        repeaty=grid_height,
+        base=seed,
+    ).astype(float) #Matriz del tamaño de la ventana
     # Normalizar valores entre 0 y 1
     min_val = world.min()
     max_val = world.max()
@@ -56,133 +161,507 @@ def generate_perlin_world(grid_width, grid_height, scale=80):
         world.fill(0.5)
     return world
 
+# Parámetros del clima
+CLIMATE_PARAMS = {
+    'T_sea_level': 20,  # Temperatura al nivel del mar (°C)
+    'T_gradient': -6.5,  # Gradiente térmico (°C por 1000m)
+    'H_sea_level': 100,  # Humedad al nivel del mar (%)
+    'H_gradient': -15,   # Gradiente de humedad (% por 1000m)
+    'max_depth': -2000,  # Máxima profundidad del océano (m)
+    'max_altitude': 4000,  # Máxima altitud de las montañas (m)
+}
+
+# Umbrales de los biomas (altitud normalizada, humedad en % y temperatura en °C)
+BIOME_THRESHOLDS = {
+    'deep_water': 0.2,
+    'shallow_water': 0.4,
+    'beach': 0.43,
+    'meadow': 0.5,
+    'meadow_humidity': 50,
+    'forest': 0.8,
+    'forest_humidity': 70,
+    'forest_temperature': 10,
+    'mountain': 0.9,
+}
+
 #Función para el cálculo de la temperatura y humedad que graficaremos posteriormente
-def calculate_temperature_and_humidity(world, grid_width, grid_height):
-    
-    temperature = np.zeros_like(world)
-    humidity = np.zeros_like(world)
+def calculate_temperature_and_humidity(world, grid_width, grid_height, params=CLIMATE_PARAMS):
     
     # Parámetros
-    T_sea_level = 20  # Temperatura al nivel del mar (°C)
-    T_gradient = -6.5  # Gradiente térmico (°C por 1000m)
-    H_sea_level = 100  # Humedad al nivel del mar (%)
-    H_gradient = -15   # Gradiente de humedad (% por 1000m)
-    max_depth = -2000  # Máxima profundidad del océano (m)
-    max_altitude = 4000  # Máxima altitud de las montañas (m)
+    T_sea_level = params['T_sea_level']
+    T_gradient = params['T_gradient']
+    H_sea_level = params['H_sea_level']
+    H_gradient = params['H_gradient']
+    max_depth = params['max_depth']
+    max_altitude = params['max_altitude']
     
     # Reescalar altitudes a metros considerando el 0 de altitud como el nivel del mar
     altitudes = (world - 0.5) * (max_altitude - max_depth) + (max_altitude + max_depth) / 2
+    underwater = altitudes < 0
 
-    for y in range(grid_height):
-        for x in range(grid_width):
-            altitud = altitudes[x, y]  # Altitud real en metros
-            
-            # Cálculo de temperatura
-            if altitud < 0:  # Bajo el nivel del mar (agua)
-                temperature[x, y] = T_sea_level - (altitud / max_depth) * 18  # Agua más fría en profundidades
-            elif altitud == 0:
-                temperature[x, y] = T_sea_level #Temperatura al nivel del mar
-            elif altitud > 0:
-                temperature[x, y] = T_sea_level - (altitud / 1000) * abs(T_gradient) #Descenso de temperatura con el aumento de altitud
-                
-            # Cálculo de humedad
-            if altitud < 0:  
-                humidity[x, y] = 100  # Alta humedad en el agua
-            else:  
-                humidity[x, y] = max(0, H_sea_level + (altitud / 1000) * H_gradient) #Descenso con el aumento de altitud
+    # Cálculo de temperatura: agua más fría en profundidades y descenso con la altitud sobre el nivel del mar
+    temperature = np.where(underwater,
+                           T_sea_level - (altitudes / max_depth) * 18,
+                           T_sea_level - (altitudes / 1000) * abs(T_gradient)).astype(np.float32)
+
+    # Cálculo de humedad: alta en el agua y descenso con el aumento de altitud
+    humidity = np.where(underwater, 100,
+                        np.maximum(0, H_sea_level + (altitudes / 1000) * H_gradient)).astype(np.float32)
 
     return temperature, humidity
 
 
-# Determinar biomas basados en altitud, temperatura y humedad
-
-def assign_biomes(world, temperature, humidity):
-    biomes = np.empty(world.shape, dtype=object)
-
-    for x in range(GRID_WIDTH):
-        for y in range(GRID_HEIGHT):
-            altitud = world[x, y]
-            temp = temperature[x, y]
-            hum = humidity[x, y]
-            
-            # Asignar biomas
-            if altitud < 0.2:  # Aguas profundas
-                biomes[x, y] = "deep_water"
-            elif altitud < 0.4:  # Aguas superficiales
-                biomes[x, y] = "shallow_water"
-            elif altitud < 0.43:  # Playas
-                biomes[x, y] = "beach"
-            elif altitud < 0.5 and hum > 50:  # Praderas
-                biomes[x, y] = "meadow"
-            elif altitud < 0.8 and hum > 70 and temp > 10:  # Bosques (requieren más humedad y temperatura moderada)
-                biomes[x, y] = "forest"
-            elif altitud < 0.9:  # Montañas
-                biomes[x, y] = "mountain"
-            else:  
-                biomes[x, y] = "snow" # Zonas de nieve
-
-    return biomes
-
-
-# Dibujar el mapa en función de los biomas asignados
-def draw_world_to_surface(biomes):
-    surface = pygame.Surface((WIDTH, HEIGHT))
-    for x in range(GRID_WIDTH):
-        for y in range(GRID_HEIGHT):
-            biome = biomes[x, y]
-            color = COLORS[biome]
-            pygame.draw.rect(surface, color, (x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
+# Determinar biomas basados en altitud, temperatura y humedad (códigos de BIOMES)
+
+def assign_biomes(world, temperature, humidity, thresholds=BIOME_THRESHOLDS):
+    t = thresholds
+    conditions = [
+        world < t['deep_water'],  # Aguas profundas
+        world < t['shallow_water'],  # Aguas superficiales
+        world < t['beach'],  # Playas
+        (world < t['meadow']) & (humidity > t['meadow_humidity']),  # Praderas
+        # Bosques (requieren más humedad y temperatura moderada)
+        (world < t['forest']) & (humidity > t['forest_humidity']) & (temperature > t['forest_temperature']),
+        world < t['mountain'],  # Montañas
+    ]
+    names = ["deep_water", "shallow_water", "beach", "meadow", "forest", "mountain"]
+    return np.select(conditions, [BIOME_CODE[name] for name in names], BIOME_CODE["snow"]).astype(np.uint8) # Zonas de nieve
+
+
+# Dibujar el mapa en función de los biomas asignados: los códigos pasan por la paleta BIOME_COLORS a un
+# array RGB de una celda por píxel, que se vuelca con surfarray y se amplía CELL_SIZE veces de una vez
+def draw_world_to_surface(biomes, surface_size=(WIDTH, HEIGHT)):
+    size = (biomes.shape[0] * CELL_SIZE, biomes.shape[1] * CELL_SIZE)
+    surface = pygame.Surface(surface_size)
+    cells = pygame.surfarray.make_surface(BIOME_COLORS[biomes])
+    pygame.transform.scale(cells, size, surface.subsurface((0, 0) + size))
     return surface
 
-# Creamos el mapa
-world = generate_perlin_world(GRID_WIDTH, GRID_HEIGHT)
-temperature, humidity = calculate_temperature_and_humidity(world, GRID_WIDTH, GRID_HEIGHT)
-biomes = assign_biomes(world, temperature, humidity)
-world_surface = draw_world_to_surface(biomes)
+# Arrays de memoria compartida del mapa: altitud, temperatura, humedad y biomas
+SHARED_MAPS = (('world', np.float64), ('temperature', np.float32), ('humidity', np.float32), ('biomes', np.uint8))
 
+def attach_shared(names, shape):
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, (_, dtype) in zip(blocks, SHARED_MAPS)]
+    return blocks, arrays
 
-# Bucle principal de Pygame
-running = True
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-    
-    # Mostrar el mundo generado
-    screen.fill((0, 0, 0))
-    screen.blit(world_surface, (0, 0))
-    pygame.display.flip()
-
-#Generamos las gráficas
-# Escalamos la altitud a metros
-altitud_metros = (world - 0.5) * (4000 - (-2000)) + (4000 + (-2000)) / 2
-
-# Crear graficas
-#Gráfica de altitud
-plt.figure(figsize=(12, 7))
-plt.title("Mapa de Altitud (m)")
-plt.imshow(altitud_metros.T, origin='upper', cmap='terrain', extent=[0, WIDTH, 0, HEIGHT]) 
-plt.colorbar(label='Altitud (m)')
-plt.xlabel('X')
-plt.ylabel('Y')
-plt.tight_layout()
-
-#Gráfica de temperatura
-plt.figure(figsize=(12, 7))
-plt.title("Mapa de Temperatura (°C)")
-plt.imshow(temperature.T, origin='upper', cmap='jet', extent=[0, WIDTH, 0, HEIGHT])
-plt.colorbar(label='Temperatura (°C)')
-plt.xlabel('X')
-plt.ylabel('Y')
-plt.tight_layout()
-
-#Gráfica de humedad
-plt.figure(figsize=(12,7))
-plt.title("Mapa de Humedad (%)")
-plt.imshow(humidity.T, origin='upper', cmap='Blues',extent=[0, WIDTH, 0, HEIGHT])
-plt.colorbar(label='Humedad (%)')
-plt.xlabel('X')
-plt.ylabel('Y')
-plt.tight_layout()
-
-pygame.quit()
+# Trabajo de un proceso sobre la banda de filas [x0, x1). En la fase 'noise' calcula el ruido y devuelve
+# su mínimo y máximo; en la fase 'climate' normaliza con el rango global y, si se le han pasado sus
+# arrays, calcula clima y biomas
+def generate_band(task):
+    phase, names, shape, x0, x1, params, value_range = task
+    blocks, arrays = attach_shared(names, shape)
+    world = arrays[0]
+    scale, octaves, persistence, lacunarity, seed = params
+    band = slice(x0, x1)
+    if phase == 'noise':
+        world[band] = perlin_noise(np.arange(x0, x1) / scale, np.arange(shape[1]) / scale, octaves, persistence,
+                                   lacunarity, repeatx=shape[0], repeaty=shape[1], base=seed)
+        result = (world[band].min(), world[band].max())
+    else:
+        min_val, max_val = value_range
+        if max_val - min_val > 0:
+            world[band] = (world[band] - min_val) / (max_val - min_val)
+        else:
+            world[band] = 0.5
+        if len(arrays) > 1:
+            temperature, humidity, biomes = arrays[1:]
+            temperature[band], humidity[band] = calculate_temperature_and_humidity(world[band], x1 - x0, shape[1])
+            biomes[band] = assign_biomes(world[band], temperature[band], humidity[band])
+            del temperature, humidity, biomes
+        result = None
+    del world, arrays
+    for block in blocks:
+        block.close()
+    return result
+
+# Mapa fijo completo (altitud normalizada, temperatura, humedad y biomas; con climate=False solo la
+# altitud). Los mapas grandes se generan por bandas en un Pool: cada proceso escribe en memoria compartida
+# y solo devuelve el mínimo y el máximo de su banda, que se reducen al rango global antes de normalizar
+def generate_world(grid_width, grid_height, scale=80, octaves=6, persistence=0.5, lacunarity=2.0, seed=None,
+                   workers=None, climate=True):
+    if seed is None:
+        seed = np.random.randint(0, 100)  # Semilla aleatoria
+    workers = workers or WORKERS
+    if workers == 1 or grid_width * grid_height < PARALLEL_MIN_CELLS:
+        world = generate_perlin_world(grid_width, grid_height, scale, octaves, persistence, lacunarity, seed)
+        if not climate:
+            return (world,)
+        temperature, humidity = calculate_temperature_and_humidity(world, grid_width, grid_height)
+        return world, temperature, humidity, assign_biomes(world, temperature, humidity)
+
+    shape = (grid_width, grid_height)
+    kinds = SHARED_MAPS if climate else SHARED_MAPS[:1]
+    blocks = [shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+              for _, dtype in kinds]
+    names = [block.name for block in blocks]
+    edges = np.linspace(0, grid_width, min(workers * BANDS_PER_WORKER, grid_width) + 1).astype(int)
+    params = (scale, octaves, persistence, lacunarity, seed)
+    # El Pool se cierra con close y join, no con terminate (el with): si pygame ya está iniciado, los
+    # procesos heredan su manejador de SIGTERM, ignoran la señal y el join de terminate no acaba nunca
+    pool = Pool(workers)
+    try:
+        ranges = pool.map(generate_band, [('noise', names, shape, x0, x1, params, None)
+                                          for x0, x1 in zip(edges[:-1], edges[1:])])
+        value_range = (min(r[0] for r in ranges), max(r[1] for r in ranges))
+        pool.map(generate_band, [('climate', names, shape, x0, x1, params, value_range)
+                                 for x0, x1 in zip(edges[:-1], edges[1:])])
+        maps = [np.ndarray(shape, dtype=dtype, buffer=block.buf).copy() for block, (_, dtype) in zip(blocks, kinds)]
+    finally:
+        pool.close()
+        pool.join()
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return tuple(maps)
+
+def world_cache_path(grid_width, grid_height, scale, octaves, persistence, lacunarity, seed):
+    return os.path.join(WORLD_CACHE_DIR, f"s{seed}_e{scale}_o{octaves}_p{persistence}_l{lacunarity}_{grid_width}x{grid_height}")
+
+# Ficheros de un mundo en la caché: la altitud solo depende del ruido; el resto, también del clima y de
+# los umbrales con los que se calcularon
+def world_cache_files(path):
+    climate = repr((sorted(CLIMATE_PARAMS.items()), sorted(BIOME_THRESHOLDS.items())))
+    key = hashlib.sha256(climate.encode()).hexdigest()[:16]
+    return [os.path.join(path, name + (".npy" if name == 'world' else f"_{key}.npy")) for name, _ in SHARED_MAPS]
+
+# Mapa fijo desde la caché (arrays de solo lectura mapeados en memoria); lo que no está se genera y se guarda.
+# Sin semilla fija el mundo no se podría volver a pedir, así que se genera sin guardarlo
+def cached_world(grid_width, grid_height, scale=80, octaves=6, persistence=0.5, lacunarity=2.0, seed=None,
+                 climate=True):
+    if seed is None:
+        return generate_world(grid_width, grid_height, scale, octaves, persistence, lacunarity, climate=climate)
+    path = world_cache_path(grid_width, grid_height, scale, octaves, persistence, lacunarity, seed)
+    files = world_cache_files(path) if climate else world_cache_files(path)[:1]
+    if not all(os.path.exists(f) for f in files):
+        maps = generate_world(grid_width, grid_height, scale, octaves, persistence, lacunarity, seed,
+                              climate=climate)
+        os.makedirs(path, exist_ok=True)
+        for file, array in zip(files, maps):
+            if not os.path.exists(file):
+                # Se escribe aparte y se renombra, para no dejar nunca un fichero a medias con el nombre final
+                with open(file + ".tmp", 'wb') as f:
+                    np.save(f, array)
+                os.replace(file + ".tmp", file)
+        evict_worlds(keep=path)
+    os.utime(path)  # Marca de uso para el LRU
+    return tuple(np.load(f, mmap_mode='r') for f in files)
+
+# Borrar los mundos abiertos hace más tiempo hasta que la caché quepa en WORLD_CACHE_LIMIT (salvo keep)
+def evict_worlds(keep=None):
+    worlds = [os.path.join(WORLD_CACHE_DIR, d) for d in os.listdir(WORLD_CACHE_DIR)]
+    worlds = [w for w in worlds if os.path.isdir(w)]
+    size = {w: sum(os.path.getsize(os.path.join(w, f)) for f in os.listdir(w)) for w in worlds}
+    total = sum(size.values())
+    for world in sorted(worlds, key=os.path.getmtime):
+        if total <= WORLD_CACHE_LIMIT:
+            break
+        if world != keep:
+            shutil.rmtree(world)
+            total -= size[world]
+
+# Etapas de la generación del mapa fijo. Cada una recibe los resultados de las etapas de las que depende
+# y sus propios parámetros
+
+# Altitud normalizada, con el generador por bandas y sin clima ni biomas (salen de las tablas por nivel)
+def altitude_stage(grid_width, grid_height, scale, octaves, persistence, lacunarity, seed, cached):
+    source = cached_world if cached else generate_world
+    return source(grid_width, grid_height, scale, octaves, persistence, lacunarity, seed, climate=False)[0]
+
+# Altitud cuantizada a 16 bits
+def quantize_stage(world):
+    return np.round(np.asarray(world) * (QUANT_LEVELS - 1)).astype(np.uint16)
+
+# Temperatura y humedad de cada nivel de altitud
+def climate_stage(**params):
+    levels = np.arange(QUANT_LEVELS) / (QUANT_LEVELS - 1)
+    return calculate_temperature_and_humidity(levels, QUANT_LEVELS, 1, params)
+
+# Bioma de cada nivel de altitud, con las mismas reglas que assign_biomes
+def biome_stage(climate, **thresholds):
+    levels = np.arange(QUANT_LEVELS) / (QUANT_LEVELS - 1)
+    return assign_biomes(levels, *climate, thresholds)
+
+# Mapas de temperatura y humedad y de biomas: una sola indexación de la tabla con la altitud cuantizada
+def climate_map_stage(quantized, climate):
+    return climate[0][quantized], climate[1][quantized]
+
+def biome_map_stage(quantized, biomes):
+    return biomes[quantized]
+
+# Superficie del tamaño de la ventana: los mapas mayores se muestran enteros tomando una celda de cada step
+def surface_stage(biomes):
+    step = max(-(-biomes.shape[0] // GRID_WIDTH), -(-biomes.shape[1] // GRID_HEIGHT), 1)
+    return draw_world_to_surface(biomes[::step, ::step])
+
+# Grafo de etapas: nombre -> (etapas de las que depende, función). 'climate' y 'biomes' guardan los
+# parámetros y calculan las tablas por nivel; 'climate_map' y 'biome_map' son los mapas
+PIPELINE_STAGES = {
+    'altitude': ((), altitude_stage),
+    'quantized': (('altitude',), quantize_stage),
+    'climate': ((), climate_stage),
+    'biomes': (('climate',), biome_stage),
+    'climate_map': (('quantized', 'climate'), climate_map_stage),
+    'biome_map': (('quantized', 'biomes'), biome_map_stage),
+    'surface': (('biome_map',), surface_stage),
+}
+PIPELINE_CACHE_ENTRIES = 4  # Resultados que se guardan de las tablas por nivel y de la superficie
+MAP_STAGES = ('altitude', 'quantized', 'climate_map', 'biome_map')  # De los mapas completos, solo el último
+
+# Generación por etapas con memoria: el resultado de cada etapa se guarda con una clave formada por sus
+# parámetros y las claves de las etapas de las que depende, así que al cambiar un parámetro solo se
+# recalculan esa etapa y las que dependen de ella (y volver a un valor anterior no recalcula nada)
+class WorldPipeline:
+    def __init__(self, grid_width, grid_height, scale=80, octaves=6, persistence=0.5, lacunarity=2.0, seed=None):
+        cached = WORLD_CACHE and seed is not None  # Solo los mundos con semilla fija van a la caché en disco
+        if seed is None:
+            seed = np.random.randint(0, 100)  # Semilla aleatoria
+        self.params = {
+            'altitude': dict(grid_width=grid_width, grid_height=grid_height, scale=scale, octaves=octaves,
+                             persistence=persistence, lacunarity=lacunarity, seed=seed, cached=cached),
+            'climate': dict(CLIMATE_PARAMS),
+            'biomes': dict(BIOME_THRESHOLDS),
+        }
+        for stage in PIPELINE_STAGES:
+            self.params.setdefault(stage, {})
+        self.cache = {stage: OrderedDict() for stage in PIPELINE_STAGES}
+
+    # Cambiar parámetros de una etapa
+    def set(self, stage, **params):
+        self.params[stage].update(params)
+
+    def key(self, stage):
+        depends, _ = PIPELINE_STAGES[stage]
+        return (tuple(sorted(self.params[stage].items())),) + tuple(self.key(d) for d in depends)
+
+    # Resultado de una etapa, calculando solo lo que no está en la memoria
+    def get(self, stage):
+        key = self.key(stage)
+        cache = self.cache[stage]
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        depends, function = PIPELINE_STAGES[stage]
+        inputs = [self.get(d) for d in depends]
+        # Se libera sitio antes de calcular, para no tener a la vez más mapas completos de los necesarios
+        limit = 1 if stage in MAP_STAGES else PIPELINE_CACHE_ENTRIES
+        while len(cache) >= limit:
+            cache.popitem(last=False)
+        result = function(*inputs, **self.params[stage])
+        cache[key] = result
+        return result
+
+# Caché de teselas del mundo infinito. Cada tesela guarda su superficie y sus mapas de altitud,
+# temperatura y humedad; el ruido es función de las coordenadas absolutas, así que encajan sin costuras
+class TileWorld:
+    def __init__(self, seed, scale=80, octaves=6, persistence=0.5, lacunarity=2.0):
+        self.seed = seed
+        self.scale = scale
+        self.octaves = octaves
+        self.persistence = persistence
+        self.lacunarity = lacunarity
+        self.tiles = OrderedDict()  # (tx, ty) -> (superficie, altitud, temperatura, humedad)
+        self.bytes = 0
+        self.tile_pixels = TILE_SIZE * CELL_SIZE
+
+    def generate(self, key):
+        tx, ty = key
+        cells = np.arange(TILE_SIZE)
+        noise = perlin_noise((tx * TILE_SIZE + cells) / self.scale, (ty * TILE_SIZE + cells) / self.scale,
+                             self.octaves, self.persistence, self.lacunarity, base=self.seed)
+        world = np.clip(noise / (2 * TILE_NOISE_RANGE) + 0.5, 0, 1)
+        temperature, humidity = calculate_temperature_and_humidity(world, TILE_SIZE, TILE_SIZE)
+        biomes = assign_biomes(world, temperature, humidity)
+        surface = draw_world_to_surface(biomes, (self.tile_pixels, self.tile_pixels))
+        tile = (surface, world, temperature, humidity)
+        self.tiles[key] = tile
+        self.bytes += self.tile_bytes(tile)
+        while self.bytes > TILE_CACHE_BYTES and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.bytes -= self.tile_bytes(old)
+        return tile
+
+    def tile_bytes(self, tile):
+        surface = tile[0]
+        return surface.get_width() * surface.get_height() * surface.get_bytesize() + sum(a.nbytes for a in tile[1:])
+
+    # Tesela ya generada (se marca como usada) o None
+    def get(self, key):
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+        return tile
+
+    # Teselas que cubren la vista (con un margen de una tesela), de la más cercana al centro a la más lejana
+    def visible(self, camera, margin=0):
+        x0, y0 = camera[0] // self.tile_pixels - margin, camera[1] // self.tile_pixels - margin
+        x1 = (camera[0] + WIDTH - 1) // self.tile_pixels + margin
+        y1 = (camera[1] + HEIGHT - 1) // self.tile_pixels + margin
+        centre = ((camera[0] + WIDTH / 2) / self.tile_pixels - 0.5, (camera[1] + HEIGHT / 2) / self.tile_pixels - 0.5)
+        keys = [(tx, ty) for tx in range(x0, x1 + 1) for ty in range(y0, y1 + 1)]
+        return sorted(keys, key=lambda k: (k[0] - centre[0])**2 + (k[1] - centre[1])**2)
+
+    # Generar teselas que faltan (primero las visibles y después el margen) hasta agotar el tiempo
+    def fill(self, camera, budget=TILE_BUDGET):
+        start = time.perf_counter()
+        for key in self.visible(camera) + self.visible(camera, margin=1):
+            if time.perf_counter() - start > budget:
+                break
+            if key not in self.tiles:
+                self.generate(key)
+
+    # Dibujar las teselas visibles; las que aún no están se dejan en gris oscuro
+    def draw(self, screen, camera):
+        screen.fill((40, 40, 40))
+        for key in self.visible(camera):
+            tile = self.get(key)
+            if tile is not None:
+                screen.blit(tile[0], (key[0] * self.tile_pixels - camera[0], key[1] * self.tile_pixels - camera[1]))
+
+    # Mapas de altitud, temperatura y humedad de la zona de la vista (para las gráficas)
+    def region(self, camera):
+        cx, cy = camera[0] // CELL_SIZE, camera[1] // CELL_SIZE
+        maps = [np.zeros((GRID_WIDTH, GRID_HEIGHT)) for _ in range(3)]
+        for key in self.visible(camera):
+            tile = self.get(key) or self.generate(key)
+            x0, y0 = key[0] * TILE_SIZE - cx, key[1] * TILE_SIZE - cy
+            xs = slice(max(x0, 0), min(x0 + TILE_SIZE, GRID_WIDTH))
+            ys = slice(max(y0, 0), min(y0 + TILE_SIZE, GRID_HEIGHT))
+            for target, source in zip(maps, tile[1:]):
+                target[xs, ys] = source[xs.start - x0:xs.stop - x0, ys.start - y0:ys.stop - y0]
+        return maps
+
+# Deslizador horizontal para un umbral de los biomas
+class Slider:
+    LENGTH = 160
+
+    def __init__(self, key, low, high, value, x, y):
+        self.key = key
+        self.low = low
+        self.high = high
+        self.value = value
+        self.track = pygame.Rect(x + 120, y + 6, self.LENGTH, 6)
+        self.x, self.y = x, y
+        self.active = False
+
+    # Devuelve True si el evento ha cambiado el valor
+    def handle(self, event):
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and self.track.inflate(0, 14).collidepoint(event.pos):
+            self.active = True
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+            self.active = False
+        if not self.active or event.type not in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEMOTION):
+            return False
+        fraction = min(max((event.pos[0] - self.track.x) / self.track.width, 0), 1)
+        value = round(self.low + fraction * (self.high - self.low), 3)
+        changed = value != self.value
+        self.value = value
+        return changed
+
+    def draw(self, screen, font):
+        screen.blit(font.render(f"{self.key}: {self.value:g}", True, (255, 255, 255)), (self.x, self.y))
+        pygame.draw.rect(screen, (150, 150, 150), self.track)
+        knob = self.track.x + (self.value - self.low) / (self.high - self.low) * self.track.width
+        pygame.draw.circle(screen, (255, 255, 255), (int(knob), self.track.centery), 6)
+
+# La protección de __main__ evita que los procesos del Pool (que importan este fichero en Windows)
+# vuelvan a abrir la ventana
+if __name__ == "__main__":
+    # Creamos el mapa
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Mundo Procedural Biofísico")
+
+    if TILED_WORLD:
+        tile_world = TileWorld(WORLD_SEED if WORLD_SEED is not None else np.random.randint(0, 100))
+        camera = [0, 0]
+        clock = pygame.time.Clock()
+    else:
+        pipeline = WorldPipeline(GRID_WIDTH, GRID_HEIGHT, seed=WORLD_SEED)
+        world = pipeline.get('altitude')
+        temperature, humidity = pipeline.get('climate_map')
+        world_surface = pipeline.get('surface')
+        font = pygame.font.SysFont("Arial", 14)
+        sliders = [Slider(key, low, high, BIOME_THRESHOLDS[key], WIDTH - 300, 14 + 22 * i)
+                   for i, (key, low, high) in enumerate(SLIDERS)]
+        panel = pygame.Surface((300, 22 * len(sliders) + 16))
+        panel.set_alpha(180)
+        show_sliders = True
+        clock = pygame.time.Clock()
+
+
+    # Bucle principal de Pygame
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif TILED_WORLD and event.type == pygame.MOUSEMOTION and event.buttons[0]:
+                camera[0] -= event.rel[0]
+                camera[1] -= event.rel[1]
+            elif not TILED_WORLD and event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                show_sliders = not show_sliders
+            elif not TILED_WORLD and show_sliders:
+                # Al mover un umbral solo se recalculan la tabla de biomas, el mapa de biomas y la superficie
+                for slider in sliders:
+                    if slider.handle(event):
+                        pipeline.set('biomes', **{slider.key: slider.value})
+                        world_surface = pipeline.get('surface')
+
+        if TILED_WORLD:
+            keys = pygame.key.get_pressed()
+            camera[0] += PAN_SPEED * (keys[pygame.K_RIGHT] - keys[pygame.K_LEFT])
+            camera[1] += PAN_SPEED * (keys[pygame.K_DOWN] - keys[pygame.K_UP])
+            tile_world.fill(camera)
+            tile_world.draw(screen, camera)
+            pygame.display.flip()
+            clock.tick(FPS)
+            continue
+
+        # Mostrar el mundo generado
+        screen.fill((0, 0, 0))
+        screen.blit(world_surface, (0, 0))
+        if show_sliders:
+            screen.blit(panel, (WIDTH - 310, 6))
+            for slider in sliders:
+                slider.draw(screen, font)
+        pygame.display.flip()
+        clock.tick(FPS)
+
+    # En el mundo por teselas las gráficas son de la zona que se estaba viendo al salir
+    if TILED_WORLD:
+        world, temperature, humidity = tile_world.region(camera)
+
+    #Generamos las gráficas
+    # Escalamos la altitud a metros
+    altitud_metros = (world - 0.5) * (4000 - (-2000)) + (4000 + (-2000)) / 2
+
+    # Crear graficas
+    #Gráfica de altitud
+    plt.figure(figsize=(12, 7))
+    plt.title("Mapa de Altitud (m)")
+    plt.imshow(altitud_metros.T, origin='upper', cmap='terrain', extent=[0, WIDTH, 0, HEIGHT]) 
+    plt.colorbar(label='Altitud (m)')
+    plt.xlabel('X')
+    plt.ylabel('Y')
+    plt.tight_layout()
+
+    #Gráfica de temperatura
+    plt.figure(figsize=(12, 7))
+    plt.title("Mapa de Temperatura (°C)")
+    plt.imshow(temperature.T, origin='upper', cmap='jet', extent=[0, WIDTH, 0, HEIGHT])
+    plt.colorbar(label='Temperatura (°C)')
+    plt.xlabel('X')
+    plt.ylabel('Y')
+    plt.tight_layout()
+
+    #Gráfica de humedad
+    plt.figure(figsize=(12,7))
+    plt.title("Mapa de Humedad (%)")
+    plt.imshow(humidity.T, origin='upper', cmap='Blues',extent=[0, WIDTH, 0, HEIGHT])
+    plt.colorbar(label='Humedad (%)')
+    plt.xlabel('X')
+    plt.ylabel('Y')
+    plt.tight_layout()
+
+    pygame.quit()